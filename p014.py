@@ -6,6 +6,37 @@
 # We can calculate each Collatz sequence recursively: if we don't know
 # the length of collatz[n], figure out the term m that follows n, and
 # then set collatz[n] to collatz[m] + 1.
+#
+# The recursive version caches every term it meets, however large, and
+# runs into the recursion limit on long sequences.  collatz_table()
+# instead fills a numpy table of lengths a block of starting numbers at
+# a time, in ascending order.  Every number below the current block is
+# already in the table, so each number in the block is stepped (all of
+# them together, in lockstep) only until it drops below the block, and
+# its length is then the number of steps taken plus the table entry
+# for the term it reached.  Terms above the table are never stored, so
+# memory use is proportional to the limit alone.
+#
+# Only the odd numbers in a block need stepping: an even n has length
+# one more than n/2, which is below the block.  Since 3n+1 is even for
+# odd n, an odd term is taken two steps at once, to (3n+1)/2.
+#
+# cached_table() keeps the table in a .npy file and extends it in
+# rounds: with the lengths below K known, every n in [K, 2K) can be
+# resolved against them independently, so each round is split into
+# segments that a pool of worker processes fill in parallel, all
+# writing disjoint slices of the same memory-mapped file.  A later run
+# with a larger limit starts from the table already in the file.  The
+# extended table is written to a temporary file which then replaces
+# the cache, so an interrupted run leaves the old cache intact.
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy
 
 collatz = {}
 collatz[0] = 1
@@ -16,10 +47,198 @@ def find_collatz(n):
        collatz[n-1] = find_collatz(c) + 1
     return collatz[n-1]
 
-maxc = 1
-for i in range(1,1000000):
-    c = find_collatz(i)
-    if c > collatz[maxc-1]:
-        maxc = i
+# Sequence lengths are stored as uint16: the longest sequence for any
+# starting number below 2**64 is far shorter than 65535 terms.
+LENGTH_DTYPE = numpy.uint16
+
+# Numbers are stepped in blocks of this many at a time.
+BLOCKSIZE = 1 << 20
+
+# The default size of the table used by lengths().
+CACHE_LIMIT = 1 << 20
+
+# The largest odd term that can be stepped without overflowing a uint64.
+MAX_ODD_TERM = (2**64 - 2) // 3
+
+def _resolve(values, table):
+    """Returns an array with the Collatz sequence length of each of
+    VALUES, a uint64 array, stepping each value until it drops below
+    len(TABLE), where TABLE holds the known lengths.  TABLE must hold
+    at least the entries for 1 and 2.
+
+    Raises OverflowError if a sequence climbs above 2**64.
+    """
+    bound = numpy.uint64(len(table))
+    result = numpy.empty(len(values), dtype=LENGTH_DTYPE)
+    # Indexes into result of the values still being stepped.
+    pending = numpy.arange(len(values))
+    values = values.copy()
+    steps = numpy.zeros(len(values), dtype=LENGTH_DTYPE)
+    one, two = numpy.uint64(1), numpy.uint64(2)
+    one_step = LENGTH_DTYPE(1)
+    while True:
+        done = values < bound
+        if done.any():
+            result[pending[done]] = steps[done] + table[values[done]]
+            todo = ~done
+            pending, values, steps = pending[todo], values[todo], steps[todo]
+        if not len(values):
+            return result
+        odd = values & one
+        if (values[odd.astype(bool)] > MAX_ODD_TERM).any():
+            raise OverflowError("Collatz sequence exceeds 2**64")
+        # n -> n/2 for even n, and n -> (3n+1)/2 for odd n.
+        values = (values + odd * (values * two + one)) >> one
+        steps += one_step + odd.astype(LENGTH_DTYPE)
+
+def collatz_table(limit, blocksize=BLOCKSIZE):
+    """Returns a numpy array of length LIMIT whose element n is the
+    length of the Collatz sequence starting at n, for 0 < n < LIMIT.
+    Element 0 is 0.
+    """
+    table = numpy.zeros(max(limit, 3), dtype=LENGTH_DTYPE)
+    table[1:3] = [1, 2]
+    lo = 3
+    while lo < limit:
+        # A block no longer than the table below it keeps the number of
+        # steps before each value drops below the block small.
+        hi = min(lo + min(blocksize, lo), limit)
+        _fill_block(table, lo, hi, lo)
+        lo = hi
+    return table[:limit]
+
+def _fill_block(table, lo, hi, known):
+    """Fills TABLE[LO:HI] with Collatz sequence lengths, given that
+    TABLE[:KNOWN] is already filled in.  HI must be at most 2*KNOWN.
+    """
+    first_even = lo + lo % 2
+    table[first_even:hi:2] = table[first_even//2:hi//2 + hi%2] + 1
+    first_odd = lo + 1 - lo % 2
+    values = numpy.arange(first_odd, hi, 2, dtype=numpy.uint64)
+    table[first_odd:hi:2] = _resolve(values, table[:known])
+
+def load_cache(cachefile):
+    """Returns the table of lengths saved in CACHEFILE, memory-mapped
+    read-only, or None if there is no such file."""
+    if not os.path.exists(cachefile):
+        return None
+    return numpy.load(cachefile, mmap_mode='r')
+
+def cached_table(limit, cachefile, workers=None, blocksize=BLOCKSIZE):
+    """Returns a table of Collatz sequence lengths like collatz_table(),
+    with at least LIMIT entries, memory-mapped read-only from CACHEFILE.
+
+    If the table saved in CACHEFILE is too short, it is extended to
+    LIMIT entries and saved again.  If workers is given, each round of
+    extension is split into segments of BLOCKSIZE numbers which are
+    filled in by that many worker processes.
+    """
+    cache = load_cache(cachefile)
+    known = 0 if cache is None else len(cache)
+    if known >= limit:
+        return cache
+
+    tmpfile = cachefile + '.tmp'
+    table = numpy.lib.format.open_memmap(
+        tmpfile, mode='w+', dtype=LENGTH_DTYPE, shape=(limit,))
+    if known >= min(limit, blocksize):
+        table[:known] = cache
+    else:
+        # Short tables are quicker to build in this process.
+        known = min(limit, blocksize)
+        table[:known] = collatz_table(known)
+    del cache
+
+    pool = None
+    if workers:
+        table.flush()
+        pool = multiprocessing.Pool(workers, _init_table_worker, (tmpfile,))
+    try:
+        while known < limit:
+            # Every number in [known, 2*known) can be resolved against
+            # the lengths already known.
+            stop = min(2 * known, limit)
+            segments = [ (lo, min(lo + blocksize, stop), known)
+                         for lo in xrange(known, stop, blocksize) ]
+            if pool:
+                pool.map(_fill_segment, segments)
+            else:
+                for segment in segments:
+                    _fill_block(table, *segment)
+            known = stop
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    table.flush()
+    del table
+    os.rename(tmpfile, cachefile)
+    return load_cache(cachefile)
+
+# State for worker processes, set by _init_table_worker.
+_worker = {}
+
+def _init_table_worker(tablefile):
+    _worker['table'] = numpy.load(tablefile, mmap_mode='r+')
+
+def _fill_segment(segment):
+    """Fills one segment (lo, hi, known) of the shared table."""
+    lo, hi, known = segment
+    table = _worker['table']
+    _fill_block(table, lo, hi, known)
+    table.flush()
+
+def lengths(start, stop, table=None, blocksize=BLOCKSIZE):
+    """Returns a numpy array of the Collatz sequence lengths for each n
+    in [START, STOP), where START > 0.
+
+    TABLE is a table of known lengths as returned by collatz_table();
+    by default one of CACHE_LIMIT entries is built.  Memory use is
+    proportional to the size of TABLE and to STOP - START.
+    """
+    if start < 1:
+        raise ValueError("Collatz sequences start at 1")
+    if table is None:
+        table = collatz_table(CACHE_LIMIT)
+    result = numpy.empty(max(stop - start, 0), dtype=LENGTH_DTYPE)
+    for lo in xrange(start, stop, blocksize):
+        hi = min(lo + blocksize, stop)
+        values = numpy.arange(lo, hi, dtype=numpy.uint64)
+        result[lo-start:hi-start] = _resolve(values, table)
+    return result
+
+def longest_chain(limit, cachefile=None, workers=None):
+    """Returns a tuple (n, length) for the starting number n < LIMIT
+    with the longest Collatz sequence, and the length of its sequence.
+    If several numbers share the longest length, the smallest is given.
+
+    If cachefile is given, the table of lengths is kept in that file
+    by cached_table().  If workers is given, the table is built by
+    that many worker processes.
+    """
+    if cachefile is None and workers:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            return longest_chain(limit, os.path.join(tmpdir, 'collatz.npy'),
+                                 workers)
+        finally:
+            shutil.rmtree(tmpdir)
+    if cachefile is None:
+        table = collatz_table(limit)
+    else:
+        table = cached_table(limit, cachefile, workers)[:limit]
+    n = int(numpy.argmax(table))
+    return n, int(table[n])
+
 
-print "{} ({})".format(maxc, collatz[maxc-1])
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--limit', type=int, default=1000000,
+                        help='search starting numbers below LIMIT')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='build the table with this many processes')
+    parser.add_argument('--cache', default=None,
+                        help='file in which to keep the table of lengths')
+    args = parser.parse_args()
+    maxc, length = longest_chain(args.limit, args.cache, args.workers)
+    print "{} ({})".format(maxc, length)
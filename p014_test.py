@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import p014
+
+class TestEuler14(unittest.TestCase):
+    def test_find_collatz(self):
+        self.assertEqual(1, p014.find_collatz(1))
+        self.assertEqual(10, p014.find_collatz(13))
+        self.assertEqual(112, p014.find_collatz(27))
+
+    def test_collatz_table(self):
+        self.assertEqual([0, 1, 2, 8, 3, 6, 9, 17, 4, 20, 7],
+                         p014.collatz_table(11).tolist())
+        self.assertEqual([0, 1], p014.collatz_table(2).tolist())
+        self.assertEqual([], p014.collatz_table(0).tolist())
+        table = p014.collatz_table(5000, blocksize=7)
+        self.assertEqual([p014.find_collatz(n) for n in range(1, 5000)],
+                         table[1:].tolist())
+        self.assertEqual(table.tolist(), p014.collatz_table(5000).tolist())
+
+    def test_lengths(self):
+        table = p014.collatz_table(5000)
+        self.assertEqual(table[1:].tolist(),
+                         p014.lengths(1, 5000, table[:100]).tolist())
+        self.assertEqual(table[4000:4500].tolist(),
+                         p014.lengths(4000, 4500, blocksize=64).tolist())
+        self.assertEqual(
+            [p014.find_collatz(n) for n in range(10**12, 10**12 + 5)],
+            p014.lengths(10**12, 10**12 + 5).tolist())
+        self.assertEqual([], p014.lengths(10, 10).tolist())
+        with self.assertRaises(ValueError):
+            p014.lengths(0, 10)
+
+    def test_overflow(self):
+        # 2**64 - 1 is odd, so its next term is too large for a uint64.
+        with self.assertRaises(OverflowError):
+            p014.lengths(2**64 - 1, 2**64)
+
+    def test_cached_table(self):
+        expected = p014.collatz_table(5000).tolist()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cachefile = os.path.join(tmpdir, 'collatz.npy')
+            self.assertIsNone(p014.load_cache(cachefile))
+            table = p014.cached_table(1000, cachefile, blocksize=64)
+            self.assertEqual(expected[:1000], table.tolist())
+            # A longer table is built on top of the saved one.
+            table = p014.cached_table(5000, cachefile, blocksize=64)
+            self.assertEqual(expected, table.tolist())
+            self.assertEqual(expected, p014.load_cache(cachefile).tolist())
+            # A shorter table is read from the cache.
+            table = p014.cached_table(10, cachefile)
+            self.assertEqual(5000, len(table))
+            self.assertFalse(os.path.exists(cachefile + '.tmp'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_cached_table_parallel(self):
+        expected = p014.collatz_table(20000).tolist()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cachefile = os.path.join(tmpdir, 'collatz.npy')
+            table = p014.cached_table(20000, cachefile, workers=3,
+                                      blocksize=1000)
+            self.assertEqual(expected, table.tolist())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_longest_chain(self):
+        self.assertEqual((9, 20), p014.longest_chain(10))
+        self.assertEqual((97, 119), p014.longest_chain(100))
+        self.assertEqual((837799, 525), p014.longest_chain(1000000))
+        self.assertEqual((97, 119), p014.longest_chain(100, workers=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
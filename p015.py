@@ -14,33 +14,266 @@
 # lattice(19,19) = 2 paths (one to the right and one down)
 #
 # We can easily calculate each diagonal from lattice(x,20) to lattice(0,20-x).
+#
+# A table like this takes space quadratic in the size of the grid.
+# Without obstacles, though, each route through an m x n grid is a
+# choice of which m of its m+n steps go right, so there are
+# binomial(m+n, m) of them.  binomial() computes that exactly from the
+# exponent of each prime in the factorials involved (Legendre's
+# formula), which also works modulo any number.  When some points of
+# the grid are blocked, blocked_paths() still works backward through
+# the grid, but keeps only one row of the table at a time.
+#
+# PathQueries answers many queries at once from tables of factorials
+# and inverse factorials modulo a prime, looking up whole numpy arrays
+# of grid sizes together.  The tables are kept between calls for the
+# few moduli used most recently.
+
+import collections
+
+import numpy
+
+def primes_upto(n):
+    "Returns a numpy array of the primes no greater than N."
+    if n < 2:
+        return numpy.zeros(0, dtype=numpy.int64)
+    sieve = numpy.ones(n + 1, dtype=bool)
+    sieve[:2] = False
+    for p in xrange(2, int(n ** 0.5) + 1):
+        if sieve[p]:
+            sieve[p*p::p] = False
+    return numpy.flatnonzero(sieve)
+
+def factorial_exponent(n, p):
+    "Returns the exponent of prime P in N factorial."
+    e = 0
+    while n:
+        n //= p
+        e += n
+    return e
+
+def product(factors):
+    """Returns the product of FACTORS, multiplying them in pairs so
+    that the big numbers being multiplied stay of similar size."""
+    factors = list(factors)
+    if not factors:
+        return 1
+    while len(factors) > 1:
+        paired = [ a * b for a, b in zip(factors[::2], factors[1::2]) ]
+        if len(factors) % 2:
+            paired.append(factors[-1])
+        factors = paired
+    return factors[0]
+
+def binomial(n, k, mod=None):
+    """Returns the binomial coefficient C(N, K), or C(N, K) modulo MOD
+    if mod is given.  MOD need not be prime."""
+    if k < 0 or k > n:
+        return 0
+    if mod is not None:
+        result = 1 % mod
+    powers = []
+    for p in primes_upto(n):
+        p = int(p)
+        e = (factorial_exponent(n, p) - factorial_exponent(k, p)
+             - factorial_exponent(n - k, p))
+        if e:
+            if mod is None:
+                powers.append(p ** e)
+            else:
+                result = result * pow(p, e, mod) % mod
+    if mod is None:
+        return product(powers)
+    return result
+
+def lattice_paths(m, n, mod=None):
+    """Returns the number of routes from the top left to the bottom
+    right corner of an M x N grid, moving only right and down, or that
+    number modulo MOD if mod is given."""
+    return binomial(m + n, min(m, n), mod)
+
+def blocked_paths(m, n, blocked, mod=None):
+    """Returns the number of routes through an M x N grid like
+    lattice_paths(), but avoiding the grid points in BLOCKED, a
+    collection of (x, y) tuples with 0 <= x <= M and 0 <= y <= N.
+
+    Uses memory proportional to min(M, N) plus the size of BLOCKED.
+    """
+    blocked = set(blocked)
+    if m < n:
+        # Transpose the grid so that rows are the shorter side.
+        m, n = n, m
+        blocked = set((y, x) for x, y in blocked)
+    # row[y] is the number of routes from (x, y) to (m, n).
+    row = [0] * (n + 1)
+    row[n] = 1
+    for x in xrange(m, -1, -1):
+        for y in xrange(n, -1, -1):
+            if (x, y) in blocked:
+                row[y] = 0
+            elif y < n:
+                row[y] += row[y+1]
+                if mod is not None:
+                    row[y] %= mod
+    return row[0]
+
+
+def is_prime(n):
+    """Returns True if N is prime.  Uses the Miller-Rabin test with a
+    set of bases that makes it exact for N < 3.3 * 10**24."""
+    if n < 2:
+        return False
+    bases = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
+    for p in bases:
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    for a in bases:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for i in xrange(r - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+class FactorialTable:
+    """Tables of k! and 1/k! modulo a prime MOD, for 0 <= k <= SIZE,
+    where SIZE < MOD.  If mod is None, the table holds exact factorials.
+
+    When MOD is less than 2**32, the tables are uint64 arrays and
+    products of two entries cannot overflow; otherwise they are numpy
+    object arrays of Python ints.
+    """
+
+    def __init__(self, size, mod=None):
+        if mod is not None and not (is_prime(mod) and size < mod):
+            raise ValueError("modulus must be a prime greater than size")
+        self.size = size
+        self.mod = mod
+        if mod is not None and mod < 2**32:
+            dtype = numpy.uint64
+        else:
+            dtype = object
+        self._fact = numpy.empty(size + 1, dtype=dtype)
+        f = 1
+        for k in xrange(size + 1):
+            self._fact[k] = f
+            f *= k + 1
+            if mod is not None:
+                f %= mod
+        self._inverse = None
+        if mod is not None:
+            self._inverse = numpy.empty(size + 1, dtype=dtype)
+            inv = pow(int(self._fact[size]), mod - 2, mod)
+            for k in xrange(size, -1, -1):
+                self._inverse[k] = inv
+                inv = inv * k % mod
+
+    def binomial(self, n, k):
+        """Returns an array of the binomial coefficients C(N, K) for
+        arrays N and K, modulo the table's modulus.  Each N must be at
+        most the size of the table."""
+        n, k = numpy.broadcast_arrays(numpy.asarray(n, dtype=numpy.int64),
+                                      numpy.asarray(k, dtype=numpy.int64))
+        shape = n.shape
+        n, k = n.ravel(), k.ravel()
+        valid = (k >= 0) & (k <= n)
+        n, k = numpy.where(valid, n, 0), numpy.where(valid, k, 0)
+        if self.mod is None:
+            result = self._fact[n] // (self._fact[k] * self._fact[n - k])
+        else:
+            mod = self._fact.dtype.type(self.mod)
+            result = (self._fact[n] * self._inverse[k] % mod
+                      * self._inverse[n - k] % mod)
+        result[~valid] = 0
+        return result.reshape(shape)
+
+# The largest exact (mod=None) FactorialTable that PathQueries builds.
+EXACT_TABLE_LIMIT = 4096
+
+class PathQueries:
+    """Answers lattice_paths() queries for whole arrays of grid sizes.
+
+    A FactorialTable is built for each modulus, large enough for the
+    largest grid asked about so far, and kept for later calls.  Tables
+    for at most MAXTABLES moduli are kept; the least recently used is
+    dropped to make room for another.
+
+    An exact table (mod=None) holds every k! in full, so its memory use
+    grows with the square of its size.  Exact queries with m + n above
+    EXACT_TABLE_LIMIT are answered by lattice_paths() instead.
+    """
+
+    def __init__(self, maxtables=4):
+        self.maxtables = maxtables
+        self._tables = collections.OrderedDict()
+
+    def table(self, size, mod=None):
+        """Returns a FactorialTable modulo MOD with at least SIZE
+        entries, building a larger one if needed."""
+        table = self._tables.pop(mod, None)
+        if table is None or table.size < size:
+            # Grow tables geometrically, but exact tables no further than
+            # EXACT_TABLE_LIMIT, and modular tables never up to the modulus.
+            if table is not None:
+                grown = 2 * table.size
+                if mod is None:
+                    grown = min(grown, EXACT_TABLE_LIMIT)
+                size = max(size, grown)
+            if mod is not None:
+                size = min(size, mod - 1)
+            table = FactorialTable(size, mod)
+        self._tables[mod] = table
+        while len(self._tables) > self.maxtables:
+            self._tables.popitem(last=False)
+        return table
+
+    def moduli(self):
+        "Returns the moduli with cached tables, most recently used last."
+        return self._tables.keys()
+
+    def paths(self, m, n, mod=None):
+        """Returns an array of lattice_paths(m, n, mod) for each pair of
+        elements of M and N, which are broadcast against each other.
+
+        Grids with a negative side have no paths.  If mod is not a prime
+        greater than every m + n, or if mod is None and some m + n is
+        more than EXACT_TABLE_LIMIT, each query falls back to
+        lattice_paths() instead of a table lookup.
+        """
+        m, n = numpy.broadcast_arrays(numpy.asarray(m, dtype=numpy.int64),
+                                      numpy.asarray(n, dtype=numpy.int64))
+        total = m + n
+        largest = max(int(total.max()), 0) if total.size else 0
+        if mod is None:
+            use_table = largest <= EXACT_TABLE_LIMIT
+        else:
+            use_table = is_prime(mod) and largest < mod
+        if not use_table:
+            result = numpy.array(
+                [lattice_paths(int(a), int(b), mod) if a >= 0 and b >= 0
+                 else 0 for a, b in zip(m.ravel(), n.ravel())],
+                dtype=object)
+            return result.reshape(m.shape)
+        table = self.table(largest, mod)
+        result = table.binomial(total, m)
+        result[(m < 0) | (n < 0)] = 0
+        return result
+
+_queries = PathQueries()
+
+def batch_lattice_paths(m, n, mod=None):
+    """Returns an array of lattice_paths(m, n, mod) for arrays M and N,
+    using tables shared between calls; see PathQueries."""
+    return _queries.paths(m, n, mod)
+
 
-import pprint
-
-lattice = [0] * 21
-for i in range(21):
-    lattice[i] = [0] * 21
-lattice[20][20] = 1
-
-for col in range(19,0,-1):
-    x = col
-    y = 20
-    while x <= 20:
-        countdown = 0 if y == 20 else lattice[x][y+1]
-        countright = 0 if x == 20 else lattice[x+1][y]
-        lattice[x][y] = countdown + countright
-        x += 1
-        y -= 1
-
-for row in range(20,0,-1):
-    y = row
-    x = 0
-    while y >= 0:
-        countdown = 0 if y == 20 else lattice[x][y+1]
-        countright = 0 if x == 20 else lattice[x+1][y]
-        lattice[x][y] = countdown + countright
-        x += 1
-        y -= 1
-
-lattice[0][0] = lattice[1][0] + lattice[0][1]
-print lattice[0][0]
+if __name__ == '__main__':
+    print lattice_paths(20, 20)
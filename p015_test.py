@@ -0,0 +1,147 @@
+#! /usr/bin/env python
+
+import math
+import unittest
+
+import numpy
+
+import p015
+
+def table_paths(m, n, blocked=()):
+    "Counts routes through an M x N grid with a full table."
+    paths = [[0] * (n + 1) for x in range(m + 1)]
+    for x in range(m, -1, -1):
+        for y in range(n, -1, -1):
+            if (x, y) in blocked:
+                paths[x][y] = 0
+            elif x == m and y == n:
+                paths[x][y] = 1
+            else:
+                paths[x][y] = ((paths[x+1][y] if x < m else 0) +
+                               (paths[x][y+1] if y < n else 0))
+    return paths[0][0]
+
+class TestEuler15(unittest.TestCase):
+    def test_primes_upto(self):
+        self.assertEqual([], p015.primes_upto(1).tolist())
+        self.assertEqual([2], p015.primes_upto(2).tolist())
+        self.assertEqual([2, 3, 5, 7, 11, 13, 17, 19, 23, 29],
+                         p015.primes_upto(30).tolist())
+
+    def test_factorial_exponent(self):
+        self.assertEqual(0, p015.factorial_exponent(1, 2))
+        self.assertEqual(8, p015.factorial_exponent(10, 2))
+        self.assertEqual(24, p015.factorial_exponent(100, 5))
+
+    def test_binomial(self):
+        f = math.factorial
+        for n in range(30):
+            for k in range(n + 1):
+                self.assertEqual(f(n) // (f(k) * f(n - k)),
+                                 p015.binomial(n, k))
+        self.assertEqual(0, p015.binomial(5, 6))
+        self.assertEqual(0, p015.binomial(5, -1))
+        self.assertEqual(f(3000) // f(1000) // f(2000),
+                         p015.binomial(3000, 1000))
+
+    def test_binomial_mod(self):
+        exact = p015.binomial(500, 200)
+        for mod in [1, 2, 12, 97, 10**9 + 7, 2**64]:
+            self.assertEqual(exact % mod, p015.binomial(500, 200, mod))
+
+    def test_lattice_paths(self):
+        self.assertEqual(1, p015.lattice_paths(0, 0))
+        self.assertEqual(6, p015.lattice_paths(2, 2))
+        self.assertEqual(137846528820, p015.lattice_paths(20, 20))
+        for m in range(6):
+            for n in range(6):
+                self.assertEqual(table_paths(m, n), p015.lattice_paths(m, n))
+        self.assertEqual(137846528820 % 1000,
+                         p015.lattice_paths(20, 20, 1000))
+
+    def test_blocked_paths(self):
+        self.assertEqual(137846528820, p015.blocked_paths(20, 20, []))
+        self.assertEqual(2, p015.blocked_paths(2, 2, [(1, 1)]))
+        self.assertEqual(0, p015.blocked_paths(3, 1, [(0, 0)]))
+        self.assertEqual(0, p015.blocked_paths(3, 1, [(3, 1)]))
+        blocked = set([(1, 2), (3, 0), (4, 4), (2, 5)])
+        for m, n in [(5, 7), (7, 5), (6, 6)]:
+            self.assertEqual(table_paths(m, n, blocked),
+                             p015.blocked_paths(m, n, blocked))
+            self.assertEqual(table_paths(m, n, blocked) % 7,
+                             p015.blocked_paths(m, n, blocked, 7))
+
+    def test_is_prime(self):
+        primes = p015.primes_upto(1000).tolist()
+        self.assertEqual(primes, [n for n in range(1001) if p015.is_prime(n)])
+        self.assertTrue(p015.is_prime(10**9 + 7))
+        self.assertTrue(p015.is_prime(2**61 - 1))
+        self.assertFalse(p015.is_prime(2**61 + 1))
+        self.assertFalse(p015.is_prime(561))
+
+    def test_factorial_table(self):
+        table = p015.FactorialTable(30, 31)
+        self.assertEqual('uint64', table.binomial(5, 2).dtype.name)
+        n = numpy.arange(31)
+        self.assertEqual([p015.binomial(i, i // 3, 31) for i in range(31)],
+                         table.binomial(n, n // 3).tolist())
+        self.assertEqual([0, 0], table.binomial([3, 3], [-1, 4]).tolist())
+        exact = p015.FactorialTable(30)
+        self.assertEqual(p015.binomial(30, 10), exact.binomial(30, 10))
+        with self.assertRaises(ValueError):
+            p015.FactorialTable(31, 31)
+        with self.assertRaises(ValueError):
+            p015.FactorialTable(10, 12)
+
+    def test_path_queries(self):
+        queries = p015.PathQueries(maxtables=2)
+        m = numpy.array([0, 1, 5, 20, 3, -1, 7])
+        n = numpy.array([0, 4, 5, 20, 0, 2, 13])
+        for mod in [None, 97, 10**9 + 7, 2**61 - 1, 1000, 7]:
+            expected = [p015.lattice_paths(a, b, mod) if a >= 0 else 0
+                        for a, b in zip(m.tolist(), n.tolist())]
+            self.assertEqual(expected,
+                             [int(x) for x in queries.paths(m, n, mod)])
+        # Only prime moduli greater than every m + n use tables.
+        self.assertEqual([10**9 + 7, 2**61 - 1], queries.moduli())
+        self.assertEqual(137846528820, queries.paths(20, 20))
+        self.assertEqual([2**61 - 1, None], queries.moduli())
+        self.assertEqual((2, 3), queries.paths([[1], [2]], [1, 2, 3]).shape)
+
+    def test_path_queries_negative(self):
+        queries = p015.PathQueries()
+        for mod in [None, 97, 1000]:
+            self.assertEqual([0], queries.paths([-1], [-1], mod).tolist())
+            self.assertEqual([0, 0],
+                             queries.paths([-3, 2], [1, -5], mod).tolist())
+        self.assertEqual(0, p015.batch_lattice_paths(-1, -1))
+
+    def test_path_queries_exact_limit(self):
+        queries = p015.PathQueries()
+        big = p015.EXACT_TABLE_LIMIT
+        self.assertEqual([p015.lattice_paths(big, 1), 6],
+                         queries.paths([big, 2], [1, 2]).tolist())
+        self.assertEqual([], queries.moduli())
+        # Exact tables grow up to the limit, but not beyond it.
+        self.assertEqual(big // 2 + 1, queries.table(big // 2 + 1).size)
+        self.assertEqual(big, queries.table(big // 2 + 2).size)
+
+    def test_path_queries_growth(self):
+        queries = p015.PathQueries()
+        self.assertEqual(10, queries.table(10, 97).size)
+        self.assertEqual(20, queries.table(11, 97).size)
+        self.assertEqual(20, queries.table(15, 97).size)
+        self.assertEqual(50, queries.table(50, 97).size)
+        # Tables never grow beyond the modulus.
+        self.assertEqual(96, queries.table(60, 97).size)
+        self.assertEqual(10, queries.table(10).size)
+        self.assertEqual(20, queries.table(11).size)
+
+    def test_batch_lattice_paths(self):
+        self.assertEqual([6, 137846528820 % (10**9 + 7)],
+                         p015.batch_lattice_paths([2, 20], [2, 20],
+                                                  10**9 + 7).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
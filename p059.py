@@ -24,6 +24,31 @@
 # 64-bit integer arrays and using numpy.bitwise_xor(), run time is
 # improved by a factor of 3x-5x.
 #
+# That still pays Python call and allocation overhead once per key.
+# BatchXOR decrypts a whole batch of candidate keys in one numpy call
+# by reshaping the message into rows of one key period each, and
+# broadcasting a (keys x 1 x keylen) matrix against it into an output
+# buffer that is reused from batch to batch.  This is selected with
+# the --batch option.
+#
+# Batched candidates are then run through a CandidateFilter, a series
+# of cheap vectorized tests that eliminate most wrong keys before the
+# expensive word-by-word dictionary check.  By default only the test
+# for occurrences of the key is used, since it never rejects a
+# plaintext the dictionary check would accept; thresholds for
+# printable bytes and letter frequency can be given to screen harder,
+# at the risk of missing unusual plaintexts.
+#
+# With --workers, the key space is split into shards that are searched
+# by a pool of processes sharing a single copy of the ciphertext.
+#
+# Ciphertexts too large to hold in memory can be read a chunk at a
+# time with iter_cipher_chunks(), or converted once to a raw binary file
+# with convert_cipher() and memory-mapped with load_cipher().  The
+# frequency attack only needs per-column byte counts, so stream_decipher()
+# can recover the key in a single pass over the chunks, and xor_chunks()
+# then decrypts the stream chunk by chunk.
+#
 # hitchcock:twp% python p059.py --slow
 # 107359
 # 3.221932
@@ -34,11 +59,66 @@
 
 import argparse
 import csv
+import heapq
+import itertools
+import math
+import multiprocessing
+import os
 import re
+import string
+import sys
 import time
 
 import numpy
 
+# By default, keys are known to consist of three lowercase ASCII letters.
+KEY_ALPHABET = string.ascii_lowercase
+KEY_LENGTHS = (3, 3)
+
+# Approximate relative frequencies (percent) of characters in English
+# text, including the space character.
+ENGLISH_FREQUENCIES = {
+    ' ': 18.3, 'e': 10.2, 't': 7.5, 'a': 6.5, 'o': 6.2, 'i': 5.7,
+    'n': 5.7,  's': 5.3,  'r': 5.0, 'h': 5.0, 'l': 3.3, 'd': 3.3,
+    'u': 2.3,  'c': 2.2,  'm': 2.0, 'f': 2.0, 'w': 1.7, 'g': 1.6,
+    'p': 1.5,  'y': 1.4,  'b': 1.3, 'v': 0.8, 'k': 0.6, 'x': 0.1,
+    'j': 0.1,  'q': 0.1,  'z': 0.1,
+}
+
+def byte_scores():
+    """Returns a numpy array of 256 log-likelihood scores, one for each
+    possible plaintext byte, modeling how likely that byte is to appear
+    in English text.
+
+    Lowercase letters and spaces are scored by their English frequency;
+    capital letters are scored as ten times rarer than their lowercase
+    equivalents.  Other printable characters are uncommon but possible,
+    and unprintable bytes are heavily penalized.
+    """
+    scores = numpy.empty(256)
+    scores.fill(math.log(0.0001))
+    for ch in string.printable:
+        scores[ord(ch)] = math.log(0.05)
+    for ch, freq in ENGLISH_FREQUENCIES.iteritems():
+        scores[ord(ch)] = math.log(freq)
+        if ch.isalpha():
+            scores[ord(ch.upper())] = math.log(freq / 10)
+    return scores
+
+BYTE_SCORES = byte_scores()
+
+def byte_table(chars):
+    """Returns a boolean numpy array of 256 elements that is True at the
+    index of each character in chars."""
+    table = numpy.zeros(256, dtype=bool)
+    table[[ ord(c) for c in chars ]] = True
+    return table
+
+PRINTABLE_BYTES = byte_table(string.printable)
+LETTER_BYTES = byte_table(string.ascii_letters + ' ')
+LOWERCASE = numpy.array([ ord(chr(b).lower()) for b in range(256) ],
+                        dtype=numpy.uint8)
+
 def read_csv(csvfile):
     """Reads CSV data from an input file and returns a single list
     containing all of the fields.
@@ -52,6 +132,79 @@ def read_csv(csvfile):
             data += [ int(x) for x in row ]
     return data
 
+def iter_cipher_chunks(csvfile, chunksize=1 << 20):
+    """Reads comma-separated byte values from csvfile, chunksize
+    characters at a time, and generates them as a sequence of numpy
+    uint8 arrays.  Values may be separated by commas, whitespace or
+    both.
+
+    Raises ValueError if the input file contains any non-numeric fields
+    or values outside the range 0-255.
+    """
+    with open(csvfile, 'r') as f:
+        tail = ''
+        while True:
+            text = f.read(chunksize)
+            if not text:
+                text, tail = tail, ''
+            else:
+                # The last value in the chunk may continue in the next one.
+                text = tail + text
+                cut = max(text.rfind(c) for c in ', \t\r\n')
+                text, tail = text[:cut+1], text[cut+1:]
+            if not text and not tail:
+                break
+            fields = text.replace(',', ' ').split()
+            if not fields:
+                continue
+            values = numpy.array(fields).astype(numpy.int64)
+            if values.min() < 0 or values.max() > 255:
+                raise ValueError("byte value out of range in " + csvfile)
+            yield values.astype(numpy.uint8)
+
+def read_cipher(csvfile):
+    """Reads comma-separated byte values from csvfile into a single
+    numpy uint8 array."""
+    chunks = list(iter_cipher_chunks(csvfile))
+    if not chunks:
+        return numpy.zeros(0, dtype=numpy.uint8)
+    return numpy.concatenate(chunks)
+
+def convert_cipher(csvfile, binfile):
+    """Converts the comma-separated byte values in csvfile to a raw
+    binary file, binfile, that can be opened with load_cipher()."""
+    with open(binfile, 'wb') as f:
+        for chunk in iter_cipher_chunks(csvfile):
+            chunk.tofile(f)
+
+def load_cipher(binfile):
+    """Returns a read-only, memory-mapped numpy uint8 array of the bytes
+    in binfile."""
+    if os.path.getsize(binfile) == 0:
+        return numpy.zeros(0, dtype=numpy.uint8)
+    return numpy.memmap(binfile, dtype=numpy.uint8, mode='r')
+
+def iter_array_chunks(data, chunksize=1 << 20):
+    """Generates successive slices of at most chunksize elements from
+    data, e.g. an array returned by load_cipher()."""
+    for start in xrange(0, len(data), chunksize):
+        yield data[start:start + chunksize]
+
+def xor_chunks(chunks, key):
+    """Repeatedly XORs a message, given as a sequence of numpy uint8
+    arrays, with a key, and generates the decrypted chunks.  The key
+    continues from one chunk to the next as if the chunks were a
+    single message.
+    """
+    keybytes = numpy.array([ ord(c) for c in key ], dtype=numpy.uint8)
+    offset = 0
+    for chunk in chunks:
+        phase = offset % len(keybytes)
+        # Rotate the key to start where the previous chunk left off.
+        rotated = numpy.roll(keybytes, -phase)
+        yield numpy.bitwise_xor(chunk, numpy.resize(rotated, len(chunk)))
+        offset += len(chunk)
+
 def read_dictionary(dictfile='/usr/share/dict/words'):
     """Reads the contents of the specified dictionary.
     Returns a set of all the dictionary entries found.
@@ -62,10 +215,244 @@ def read_dictionary(dictfile='/usr/share/dict/words'):
             d.add(word.strip())
     return d
 
+class DictionaryIndex:
+    """A read-only dictionary of words stored on disk as a sorted numpy
+    array of fixed-width byte strings.
+
+    The index file is memory-mapped rather than read, so it opens almost
+    instantly and every process that opens it shares the same pages.
+    Membership is tested by binary search.  A DictionaryIndex can be
+    used anywhere a set of words is expected for `in` tests; pickling
+    one only records the path of its index file.
+    """
+
+    def __init__(self, indexfile):
+        self._indexfile = indexfile
+        self._words = numpy.load(indexfile, mmap_mode='r')
+
+    def __getstate__(self):
+        return self._indexfile
+
+    def __setstate__(self, indexfile):
+        self.__init__(indexfile)
+
+    def __len__(self):
+        return len(self._words)
+
+    def __contains__(self, word):
+        if len(word) > self._words.dtype.itemsize:
+            return False
+        i = numpy.searchsorted(self._words, word)
+        return i < len(self._words) and self._words[i] == word
+
+    def contains_many(self, words):
+        """Returns a boolean numpy array that is True for each element
+        of the list words that is found in the dictionary."""
+        if not words or not len(self._words):
+            return numpy.zeros(len(words), dtype=bool)
+        # Words longer than the index's width would be truncated to it,
+        # and must never match.
+        lengths = numpy.array([ len(w) for w in words ])
+        words = numpy.array(words, dtype=self._words.dtype)
+        i = numpy.searchsorted(self._words, words)
+        found = self._words[numpy.minimum(i, len(self._words) - 1)] == words
+        return found & (lengths <= self._words.dtype.itemsize)
+
+    @classmethod
+    def build(cls, words, indexfile):
+        """Writes the index for the iterable words to indexfile, and
+        returns a DictionaryIndex for it."""
+        words = sorted(set(words))
+        width = max([ len(w) for w in words ] + [1])
+        # Write through a file object, so that numpy.save() does not add
+        # '.npy' to an indexfile named otherwise.
+        with open(indexfile, 'wb') as f:
+            numpy.save(f, numpy.array(words, dtype='S{}'.format(width)))
+        return cls(indexfile)
+
+
+def load_dictionary_index(dictfile, indexfile):
+    """Returns a DictionaryIndex of the words in dictfile, stored in
+    indexfile.  The index is built first if indexfile does not exist or
+    is older than dictfile.
+    """
+    if (not os.path.exists(indexfile) or
+            os.path.getmtime(indexfile) < os.path.getmtime(dictfile)):
+        return DictionaryIndex.build(read_dictionary(dictfile), indexfile)
+    return DictionaryIndex(indexfile)
+
+
+class BatchXOR:
+    """Decrypts a single message with many candidate keys at once.
+
+    The message is stored once as a (rows x keylen) uint8 matrix, zero
+    padded to a whole number of key periods, so that XORing it with a
+    (keys x keylen) matrix of candidate keys is a single broadcast
+    numpy.bitwise_xor() call.
+    """
+
+    def __init__(self, msg, keylen):
+        data = numpy.asarray(msg, dtype=numpy.uint8)
+        self._msglen = len(data)
+        nrows = -(-len(data) // keylen)
+        self._rows = numpy.zeros((nrows, keylen), dtype=numpy.uint8)
+        self._rows.ravel()[:len(data)] = data
+        self._out = None
+
+    def keylen(self):
+        return self._rows.shape[1]
+
+    def xor(self, keys):
+        """XORs the message with every key in keys, a (num_keys x keylen)
+        uint8 matrix such as one produced by XORDecoder.key_batches().
+
+        Returns a (num_keys x msglen) uint8 array whose row i is the
+        message decrypted with keys[i].  The array is a view of an
+        output buffer that is reused by the next call to xor(), so
+        callers must copy any rows they want to keep.
+        """
+        keys = numpy.asarray(keys, dtype=numpy.uint8)
+        nkeys = len(keys)
+        if self._out is None or len(self._out) < nkeys:
+            self._out = numpy.empty((nkeys,) + self._rows.shape,
+                                    dtype=numpy.uint8)
+        out = self._out[:nkeys]
+        numpy.bitwise_xor(self._rows[numpy.newaxis],
+                          keys[:, numpy.newaxis, :], out=out)
+        return out.reshape(nkeys, -1)[:, :self._msglen]
+
+
+class CandidateFilter:
+    """A pipeline of increasingly expensive tests for batches of
+    candidate plaintexts, as produced by BatchXOR.
+
+    The stages are, in order:
+
+    printable: at least min_printable of the bytes are printable ASCII.
+    letters:   at least min_letters of the bytes are letters or spaces,
+               and at least min_spaces of the bytes decrypted by each
+               character of the key are spaces.
+    key:       the key occurs at least twice in the lowercased plaintext.
+    words:     the candidate passes the decoder's is_plaintext() test.
+
+    The first three stages are evaluated for a whole batch at once with
+    numpy, and each stage only examines the candidates that survived
+    the previous one.  The filter keeps a running count of how many
+    candidates each stage eliminated.
+
+    The printable and letters stages are heuristics that can reject
+    plaintexts is_plaintext() would accept, such as text without
+    spaces, so they are skipped unless their thresholds are given.
+    With the default thresholds, the filter passes exactly the
+    candidates that is_plaintext() accepts.
+    """
+
+    STAGES = ('printable', 'letters', 'key', 'words')
+
+    def __init__(self, decoder, min_printable=0, min_letters=0,
+                 min_spaces=0):
+        self._decoder = decoder
+        self._min_printable = min_printable
+        self._min_letters = min_letters
+        self._min_spaces = min_spaces
+        self.reset()
+
+    def reset(self):
+        """Clears the candidate and elimination counts."""
+        self._candidates = 0
+        self._eliminated = dict.fromkeys(self.STAGES, 0)
+
+    def candidates(self):
+        """Returns the number of candidates examined since the last
+        reset()."""
+        return self._candidates
+
+    def eliminated(self):
+        """Returns a list of (stage, count) tuples giving the number of
+        candidates eliminated by each stage since the last reset()."""
+        return [ (stage, self._eliminated[stage]) for stage in self.STAGES ]
+
+    def add_counts(self, candidates, eliminated):
+        """Adds counts reported by another filter's candidates() and
+        eliminated() methods to this filter's counts."""
+        self._candidates += candidates
+        for stage, count in eliminated:
+            self._eliminated[stage] += count
+
+    def _keep(self, stage, rows, mask):
+        self._eliminated[stage] += len(rows) - numpy.count_nonzero(mask)
+        return rows[mask]
+
+    def apply(self, plaintexts, keys):
+        """Filters a batch of candidate plaintexts.
+
+        plaintexts: a (num_keys x msglen) uint8 array
+        keys: the (num_keys x keylen) uint8 array of keys that produced them
+
+        Returns a list of the indices of the candidates that passed every
+        stage, in ascending order.
+        """
+        nkeys, msglen = plaintexts.shape
+        keylen = keys.shape[1]
+        self._candidates += nkeys
+        rows = numpy.arange(nkeys)
+
+        if self._min_printable:
+            printable = PRINTABLE_BYTES[plaintexts].sum(axis=1)
+            rows = self._keep('printable', rows,
+                              printable >= self._min_printable * msglen)
+
+        # A wrong key character rarely decrypts anything to a space, so
+        # counting spaces separately in each key column rejects keys
+        # that are only partly right.
+        if self._min_letters or self._min_spaces:
+            candidates = plaintexts[rows]
+            mask = LETTER_BYTES[candidates].sum(axis=1) >= (
+                self._min_letters * msglen)
+            for j in range(min(keylen, msglen)):
+                column = candidates[:, j::keylen]
+                spaces = (column == ord(' ')).sum(axis=1)
+                mask &= spaces >= self._min_spaces * column.shape[1]
+            rows = self._keep('letters', rows, mask)
+
+        # Count every (possibly overlapping) window of the lowercased
+        # plaintext that matches the key.  Overlapping matches are never
+        # fewer than the non-overlapping ones counted by is_plaintext(),
+        # so this stage cannot reject a candidate that it would accept.
+        nwindows = max(msglen - keylen + 1, 0)
+        lowered = LOWERCASE[plaintexts[rows]]
+        matches = numpy.ones((len(rows), nwindows), dtype=bool)
+        for j in range(keylen):
+            matches &= (lowered[:, j:j+nwindows] ==
+                        keys[rows, j][:, numpy.newaxis])
+        rows = self._keep('key', rows, matches.sum(axis=1) >= 2)
+
+        passed = [ i for i in rows
+                   if self._decoder.is_plaintext(plaintexts[i].tostring(),
+                                                 keys[i].tostring()) ]
+        self._eliminated['words'] += len(rows) - len(passed)
+        return passed
+
+
 class XORDecoder:
 
-    def __init__(self, dictfile=None):
-        self._dict = read_dictionary(dictfile) if dictfile else None
+    def __init__(self, dictfile=None, alphabet=KEY_ALPHABET,
+                 keylengths=KEY_LENGTHS, indexfile=None):
+        """Creates a decoder for keys made up of characters from
+        alphabet, whose length is in the inclusive range given by the
+        (min, max) tuple keylengths.
+
+        If indexfile is given, the words in dictfile are loaded through a
+        DictionaryIndex stored in that file instead of being read into a
+        set.
+        """
+        if dictfile and indexfile:
+            self._dict = load_dictionary_index(dictfile, indexfile)
+        else:
+            self._dict = read_dictionary(dictfile) if dictfile else None
+        self._alphabet = alphabet
+        self._keylengths = keylengths
+        self._filter = CandidateFilter(self)
 
     def dictionary(self):
         return self._dict
@@ -73,14 +460,130 @@ class XORDecoder:
     def set_dictionary(self, d):
         self._dict = d
 
-    def key_generator(self):
-        """Generates all possible three-character lowercase keys.
+    def candidate_filter(self):
+        """Returns the CandidateFilter used by batched decipher() calls."""
+        return self._filter
+
+    def set_candidate_filter(self, f):
+        self._filter = f
+
+    def alphabet(self):
+        return self._alphabet
+
+    def keylengths(self):
+        return self._keylengths
+
+    def is_plaintext(self, cleartext, key):
+        """Returns True if cleartext looks like the correct decryption
+        of a message with the given key, i.e. if it includes at least
+        two occurrences of the key and at least half of its words
+        five letters or longer are found in the dictionary.
+        """
+        # The cleartext is known to include repeated instances of the key.
+        # Skip any possible solutions that do not include the key at least
+        # twice.
+        if cleartext.lower().count(key) < 2:
+            return False
+
+        # The text is expected to consist principally of English
+        # words; however, it is not guaranteed that every word in
+        # the text is English or that it will be found in the
+        # dictionary we have.  Report success if we found at least
+        # one dictionary word, and of the cleartext words that are
+        # five letters or longer, at least half are found in the
+        # dictionary.
+        words = re.findall(r'[A-Za-z]+', cleartext)
+        longwords = [ w for w in words if len(w) >= 5 ]
+        englishwords = [ w for w in longwords if w in self._dict ]
+        return bool(englishwords) and len(englishwords) >= len(longwords) / 2
+
+    def key_generator(self, keylen=None):
+        """Generates all possible keys of length keylen drawn from the
+        decoder's alphabet, in lexical order.  If keylen is None, generates
+        the keys for every length in the decoder's range, shortest first.
 
         Returns a string containing the key on each call to the generator."""
-        for a in range(ord('a'), ord('z')+1):
-            for b in range(ord('a'), ord('z')+1):
-                for c in range(ord('a'), ord('z')+1):
-                    yield chr(a) + chr(b) + chr(c)
+        minlen, maxlen = self._keylengths
+        lengths = [keylen] if keylen is not None else range(minlen, maxlen+1)
+        for n in lengths:
+            for key in itertools.product(self._alphabet, repeat=n):
+                yield ''.join(key)
+
+    def key_batches(self, keylen, batch_size, start=0, stop=None):
+        """Generates all keys of length keylen drawn from the decoder's
+        alphabet, in the same order as key_generator(), as a sequence
+        of uint8 matrices of at most batch_size rows each.  If start or
+        stop are given, only the keys whose position in that order is in
+        range(start, stop) are generated.
+
+        Keys are computed directly from their position in the sequence
+        by converting each index to base len(alphabet), so no Python
+        string is built for any key.
+        """
+        symbols = numpy.array([ ord(c) for c in self._alphabet ],
+                              dtype=numpy.uint8)
+        nsymbols = len(symbols)
+        nkeys = nsymbols ** keylen
+        if stop is None or stop > nkeys:
+            stop = nkeys
+        for first in xrange(start, stop, batch_size):
+            indices = numpy.arange(first, min(first + batch_size, stop),
+                                   dtype=numpy.int64)
+            keys = numpy.empty((len(indices), keylen), dtype=numpy.uint8)
+            for pos in range(keylen-1, -1, -1):
+                indices, digits = numpy.divmod(indices, nsymbols)
+                keys[:, pos] = symbols[digits]
+            yield keys
+
+    @classmethod
+    def key_length_scores(cls, message, minlen, maxlen):
+        """Computes the mean index of coincidence of the message's
+        columns for each key length from minlen to maxlen.
+
+        XORing a column with a single key character only relabels its
+        bytes, so when the key length is right every column keeps the
+        uneven letter distribution of English text and has a high index
+        of coincidence.  Wrong key lengths mix bytes XORed with different
+        key characters and flatten the distribution.
+
+        Returns a dict mapping each key length to its score.  Key lengths
+        that would leave fewer than two bytes in a column are omitted.
+        """
+        data = numpy.asarray(message, dtype=numpy.uint8)
+        scores = {}
+        for keylen in range(max(minlen, 1), maxlen+1):
+            nrows = len(data) // keylen
+            if nrows < 2:
+                break
+            columns = data[:nrows * keylen].reshape(nrows, keylen)
+            # Count each (column, byte) pair in a single bincount call.
+            counts = numpy.bincount(
+                (numpy.arange(keylen) * 256 + columns).ravel(),
+                minlength=keylen * 256).reshape(keylen, 256)
+            coincidences = (counts * (counts - 1)).sum(axis=1)
+            scores[keylen] = (coincidences.mean() /
+                              float(nrows * (nrows - 1)))
+        return scores
+
+    def guess_key_lengths(self, message, tolerance=0.9):
+        """Returns the key lengths in the decoder's range ordered from most
+        to least likely, according to key_length_scores().
+
+        Any multiple of the true key length scores about as well as the
+        true length does, so every length scoring within `tolerance` of
+        the best score is tried first, shortest first.
+        """
+        minlen, maxlen = self._keylengths
+        scores = self.key_length_scores(message, minlen, maxlen)
+        if not scores:
+            return range(minlen, maxlen+1)
+        best = max(scores.values())
+        likely = sorted(k for k in scores if scores[k] >= best * tolerance)
+        rest = sorted((k for k in scores if k not in likely),
+                      key=lambda k: -scores[k])
+        # Lengths too long to score are tried last.
+        unscored = [ k for k in range(minlen, maxlen+1) if k not in scores ]
+        return likely + rest + unscored
 
     @classmethod
     def fast_xor(cls, msg, key):
@@ -93,6 +596,7 @@ class XORDecoder:
         successively XORing elements of the message with the key.
         """
         msglen = len(msg)
+        data = bytearray(msg)
 
         # numpy.bitwise_xor requires the operands to be the same length.
         # If the message is longer than the key, repeat the key until
@@ -105,15 +609,14 @@ class XORDecoder:
 
         # Pad out the message and the key to a multiple of 8,
         # so we can xor 8 bytes at once.
-        data = msg
         if msglen % 8 != 0:
             padding = 8 - msglen % 8
-            data = msg + [0] * padding
+            data += bytearray(padding)
             xorkey += ''.join([chr(0)] * padding)
 
         plaintext = numpy.bitwise_xor(
-            numpy.frombuffer(bytearray(data), dtype=numpy.dtype('<Q8')),
-            numpy.fromstring(xorkey, dtype=numpy.dtype('<Q8'))).tostring()
+            numpy.frombuffer(data, dtype=numpy.dtype('<u8')),
+            numpy.fromstring(xorkey, dtype=numpy.dtype('<u8'))).tostring()
 
         return plaintext[:msglen]
 
@@ -133,9 +636,14 @@ class XORDecoder:
             plaintext += chr(msg[i] ^ ord(key[i % len(key)]))
         return plaintext
 
-    def decipher(self, message, slow=False):
+    def decipher(self, message, slow=False, batch_size=None, workers=None):
         """Attempts to decipher the message by repeatedly guessing keys.
+        If batch_size is given, keys are decrypted batch_size at a time
+        with BatchXOR and screened with the decoder's candidate_filter().
+        If workers is greater than 1, the keys are searched in parallel
+        by that many processes; see _parallel_decipher().
 
+        Key lengths are tried in the order given by guess_key_lengths().
         Returns the first plaintext string that matches the following
         conditions:
 
@@ -146,44 +654,293 @@ class XORDecoder:
         If no plaintext can be found that satisfies these conditions,
         returns None.
         """
+        if workers > 1:
+            return self._parallel_decipher(message, batch_size or 4096,
+                                           workers)
+        if batch_size:
+            return self._batch_decipher(message, batch_size)
         xor_func = XORDecoder.slow_xor if slow else XORDecoder.fast_xor
-        for key in self.key_generator():
-            cleartext = xor_func(message, key)
-
-            # The cleartext is known to include repeated instances of the key.
-            # Skip any possible solutions that do not include the key at least
-            # twice.
-            if cleartext.lower().count(key) < 2:
-                continue
-
-            # The text is expected to consist principally of English
-            # words; however, it is not guaranteed that every word in
-            # the text is English or that it will be found in the
-            # dictionary we have.  Report success if we found at least
-            # one dictionary word, and of the cleartext words that are
-            # five letters or longer, at least half are found in the
-            # dictionary.
-            words = re.findall(r'[A-Za-z]+', cleartext)
-            longwords = [ w for w in words if len(w) >= 5 ]
-            englishwords = [ w for w in longwords if w in self._dict ]
-            if englishwords and len(englishwords) >= len(longwords) / 2:
-                return cleartext
+        for keylen in self.guess_key_lengths(message):
+            for key in self.key_generator(keylen):
+                cleartext = xor_func(message, key)
+                if self.is_plaintext(cleartext, key):
+                    return cleartext
 
         # Continuing through the end of the loop means that we did not
         # find any cleartext that satisfied decryption.
         return None
 
+    def _batch_decipher(self, message, batch_size):
+        for keylen in self.guess_key_lengths(message):
+            batcher = BatchXOR(message, keylen)
+            for keys in self.key_batches(keylen, batch_size):
+                plaintexts = batcher.xor(keys)
+                passed = self._filter.apply(plaintexts, keys)
+                if passed:
+                    return plaintexts[passed[0]].tostring()
+        return None
+
+    def _parallel_decipher(self, message, batch_size, workers,
+                           shard_size=65536):
+        """Searches the key space with a pool of worker processes.
+
+        The keys of every length are split into shards of shard_size
+        keys, numbered in the order decipher() would try them.  Each
+        worker keeps the ciphertext in a shared memory array inherited
+        from this process, and the lowest shard number known to contain
+        a match is published in a shared value so that workers skip any
+        later shards.  Shard results are collected in order, so the
+        plaintext returned is always the first one decipher() would find.
+        """
+        shards = []
+        nsymbols = len(self._alphabet)
+        for keylen in self.guess_key_lengths(message):
+            for start in xrange(0, nsymbols ** keylen, shard_size):
+                shards.append((len(shards), keylen, start, start + shard_size,
+                               batch_size))
+
+        data = numpy.asarray(message, dtype=numpy.uint8)
+        shared_msg = multiprocessing.RawArray('B', len(data))
+        numpy.frombuffer(shared_msg, dtype=numpy.uint8)[:] = data
+        found = multiprocessing.Value('l', sys.maxint)
+
+        pool = multiprocessing.Pool(workers, _init_decipher_worker,
+                                    (self, shared_msg, found))
+        try:
+            for cleartext, candidates, eliminated in pool.imap(
+                    _decipher_shard, shards):
+                self._filter.add_counts(candidates, eliminated)
+                if cleartext is not None:
+                    return cleartext
+        finally:
+            pool.terminate()
+            pool.join()
+        return None
+
+    @classmethod
+    def column_scores(cls, message, keylen, alphabet=KEY_ALPHABET):
+        """Scores every candidate key character for each position in
+        a key of length keylen.
+
+        The message is split into keylen columns, where column i holds
+        every byte that would be XORed with key[i].  Each candidate key
+        character decrypts a column into a plaintext byte histogram that
+        is a permutation of the column's ciphertext histogram, so every
+        candidate can be scored against BYTE_SCORES with a single matrix
+        product per column.
+
+        Returns a numpy array of shape (keylen, len(alphabet)) in
+        which element [i, j] is the score of alphabet[j] as key[i].
+        Higher scores are better.
+        """
+        counts = cls.column_counts([message], keylen)
+        return cls.count_scores(counts, alphabet)
+
+    @classmethod
+    def column_counts(cls, chunks, keylen, offset=0):
+        """Counts the bytes in each of the keylen columns of a message
+        given as a sequence of chunks, which continue one another as in
+        xor_chunks().  offset is the position in the message of the
+        first chunk.
+
+        Returns a (keylen x 256) numpy array in which element [i, b] is
+        the number of times byte b occurs in column i.
+        """
+        counts = numpy.zeros((keylen, 256), dtype=numpy.int64)
+        for chunk in chunks:
+            data = numpy.asarray(chunk, dtype=numpy.uint8)
+            for col in range(keylen):
+                first = (col - offset) % keylen
+                counts[col] += numpy.bincount(data[first::keylen],
+                                              minlength=256)
+            offset += len(data)
+        return counts
+
+    @classmethod
+    def count_scores(cls, counts, alphabet=KEY_ALPHABET):
+        """Scores every candidate key character in alphabet for each
+        column of the byte counts returned by column_counts().  See
+        column_scores()."""
+        candidates = numpy.array([ ord(c) for c in alphabet ],
+                                 dtype=numpy.uint8)
+        # weights[j, b] is the score of ciphertext byte b when
+        # decrypted with candidate j.
+        weights = BYTE_SCORES[numpy.bitwise_xor.outer(
+            candidates, numpy.arange(256, dtype=numpy.uint8))]
+        return counts.dot(weights.T)
+
+    @classmethod
+    def best_keys(cls, scores, alphabet=KEY_ALPHABET):
+        """Generates keys in order of decreasing total score, given
+        the per-position scores returned by column_scores().
+
+        The search starts with the best-scoring character in every
+        position, and each subsequent key is found by demoting one
+        position of an earlier key to its next-best character, so
+        only the keys actually requested are ever constructed.
+        """
+        keylen, ncandidates = scores.shape
+        if keylen == 0:
+            return
+        ranked = numpy.argsort(-scores, axis=1, kind='mergesort')
+        ranked_scores = [ scores[i][ranked[i]] for i in range(keylen) ]
+
+        def total(ranks):
+            return sum(ranked_scores[i][r] for i, r in enumerate(ranks))
+
+        start = (0,) * keylen
+        heap = [(-total(start), start)]
+        seen = set([start])
+        while heap:
+            _, ranks = heapq.heappop(heap)
+            yield ''.join(alphabet[ranked[i][r]]
+                          for i, r in enumerate(ranks))
+            for i in range(keylen):
+                if ranks[i] + 1 < ncandidates:
+                    nxt = ranks[:i] + (ranks[i] + 1,) + ranks[i+1:]
+                    if nxt not in seen:
+                        seen.add(nxt)
+                        heapq.heappush(heap, (-total(nxt), nxt))
+
+    def frequency_decipher(self, message, keylen=None, candidates=100):
+        """Attempts to decipher the message with a frequency attack.
+
+        Rather than trying every possible key, each key position is
+        scored independently with column_scores(), and only the
+        `candidates` best-scoring keys are fully decrypted and checked
+        with is_plaintext().  This costs O(26 * N) for a message of
+        length N instead of O(26^keylen * N), which makes it practical
+        to attack keys longer than three characters.
+
+        If keylen is None, each length returned by guess_key_lengths()
+        is attacked in turn.
+
+        Returns the plaintext for the first key that satisfies
+        is_plaintext(), or None if none of the candidate keys do.
+        """
+        keylens = [keylen] if keylen else self.guess_key_lengths(message)
+        for n in keylens:
+            scores = self.column_scores(message, n, self._alphabet)
+            keys = self.best_keys(scores, self._alphabet)
+            for key in itertools.islice(keys, candidates):
+                cleartext = XORDecoder.fast_xor(message, key)
+                if self.is_plaintext(cleartext, key):
+                    return cleartext
+        return None
+
+    def stream_decipher(self, chunks, keylen=None, candidates=100,
+                        sample_size=1 << 16):
+        """Attempts to find the key for a message too large to hold in
+        memory, given as a sequence of numpy uint8 chunks such as those
+        generated by iter_cipher_chunks() or iter_array_chunks().
+
+        The chunks are read only once.  Column byte counts are gathered
+        for every key length in the decoder's range (or only keylen, if
+        given), and the first sample_size bytes are kept as a sample.
+        The best keys for each length, tried in the order given by
+        guess_key_lengths() on the sample, are then checked against
+        the decrypted sample with is_plaintext().
+
+        Returns the first key that satisfies is_plaintext(), or None.
+        The message can then be decrypted with xor_chunks().
+        """
+        if keylen:
+            lengths = [keylen]
+        else:
+            minlen, maxlen = self._keylengths
+            lengths = range(minlen, maxlen+1)
+
+        counts = dict((n, numpy.zeros((n, 256), dtype=numpy.int64))
+                      for n in lengths)
+        sample = []
+        samplelen = 0
+        offset = 0
+        for chunk in chunks:
+            chunk = numpy.asarray(chunk, dtype=numpy.uint8)
+            for n in lengths:
+                counts[n] += self.column_counts([chunk], n, offset)
+            if samplelen < sample_size:
+                sample.append(numpy.array(chunk[:sample_size - samplelen]))
+                samplelen += len(sample[-1])
+            offset += len(chunk)
+        if not sample:
+            return None
+        sample = numpy.concatenate(sample)
+
+        if not keylen:
+            lengths = self.guess_key_lengths(sample)
+        for n in lengths:
+            scores = self.count_scores(counts[n], self._alphabet)
+            keys = self.best_keys(scores, self._alphabet)
+            for key in itertools.islice(keys, candidates):
+                if self.is_plaintext(XORDecoder.fast_xor(sample, key), key):
+                    return key
+        return None
+
+# State shared by the worker processes of XORDecoder._parallel_decipher().
+_worker = {}
+
+def _init_decipher_worker(decoder, shared_msg, found):
+    _worker['decoder'] = decoder
+    _worker['message'] = numpy.frombuffer(shared_msg, dtype=numpy.uint8)
+    _worker['found'] = found
+
+def _decipher_shard(shard):
+    """Searches one shard of the key space for a matching plaintext.
+
+    Returns a tuple (cleartext, candidates, eliminated), where cleartext
+    is None if no match was found, and the remaining elements are the
+    filter counts for the shard.
+    """
+    seq, keylen, start, stop, batch_size = shard
+    decoder = _worker['decoder']
+    found = _worker['found']
+    f = decoder.candidate_filter()
+    f.reset()
+    cleartext = None
+    if found.value > seq:
+        batcher = BatchXOR(_worker['message'], keylen)
+        for keys in decoder.key_batches(keylen, batch_size, start, stop):
+            # Give up once an earlier shard is known to hold a match.
+            if found.value < seq:
+                break
+            plaintexts = batcher.xor(keys)
+            passed = f.apply(plaintexts, keys)
+            if passed:
+                cleartext = plaintexts[passed[0]].tostring()
+                with found.get_lock():
+                    found.value = min(found.value, seq)
+                break
+    return cleartext, f.candidates(), f.eliminated()
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--slow", help='use slow XOR', action='store_true')
+    parser.add_argument("--frequency", help='use frequency analysis',
+                        action='store_true')
+    parser.add_argument("--batch", help='decrypt BATCH keys at a time',
+                        type=int, default=None)
+    parser.add_argument("--stats", help='report candidates eliminated by '
+                        'each filter stage', action='store_true')
+    parser.add_argument("--workers", help='number of worker processes',
+                        type=int, default=None)
+    parser.add_argument("--index", help='dictionary index file to use '
+                        '(built if needed)', default=None)
     args = parser.parse_args()
 
     t1 = time.clock()
-    xd = XORDecoder(dictfile='/usr/share/dict/words')
-    msg = read_csv('p059_cipher.txt')
-    s = xd.decipher(msg, args.slow)
+    xd = XORDecoder(dictfile='/usr/share/dict/words', indexfile=args.index)
+    msg = read_cipher('p059_cipher.txt')
+    if args.frequency:
+        s = xd.frequency_decipher(msg)
+    else:
+        s = xd.decipher(msg, args.slow, args.batch, args.workers)
     msgsum = sum([ ord(ch) for ch in s ])
     t2 = time.clock()
     print msgsum
     print "{} seconds".format(t2 - t1)
+    if args.stats:
+        print "{} candidates".format(xd.candidate_filter().candidates())
+        for stage, count in xd.candidate_filter().eliminated():
+            print "  {}: {} eliminated".format(stage, count)
 
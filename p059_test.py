@@ -1,8 +1,17 @@
 #! /usr/bin/env python
 
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 
-from p059 import XORDecoder
+import numpy
+
+from p059 import BatchXOR, CandidateFilter, DictionaryIndex, XORDecoder
+from p059 import convert_cipher, iter_array_chunks, iter_cipher_chunks
+from p059 import load_cipher, load_dictionary_index, read_cipher, read_csv
+from p059 import xor_chunks
 
 class XorTestMixin:
 
@@ -60,6 +69,159 @@ class FastXorTests(unittest.TestCase, XorTestMixin):
         self.xor_func = XORDecoder.fast_xor
 
 
+class CipherFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.csvfile = os.path.join(self.tmpdir, 'cipher.txt')
+        self.binfile = os.path.join(self.tmpdir, 'cipher.bin')
+        self.data = [ (i * 37) % 256 for i in range(1000) ]
+        with open(self.csvfile, 'w') as f:
+            f.write(','.join(str(x) for x in self.data[:500]) + '\n')
+            f.write(','.join(str(x) for x in self.data[500:]) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_iter_cipher_chunks(self):
+        """Test that values split across chunk boundaries are read
+        correctly, whatever the chunk size."""
+        self.assertEqual(self.data, read_csv(self.csvfile))
+        for chunksize in [1, 2, 3, 7, 100, 1 << 20]:
+            chunks = list(iter_cipher_chunks(self.csvfile, chunksize))
+            self.assertEqual(self.data, list(numpy.concatenate(chunks)))
+        self.assertEqual(numpy.uint8, read_cipher(self.csvfile).dtype)
+
+    def test_iter_cipher_chunks_whitespace(self):
+        """Test that whitespace-separated values are split into
+        bounded chunks rather than read whole."""
+        with open(self.csvfile, 'w') as f:
+            f.write(' '.join(str(x) for x in self.data[:600]) + '\n\t')
+            f.write('\r\n'.join(str(x) for x in self.data[600:]))
+        for chunksize in [1, 7, 100]:
+            chunks = list(iter_cipher_chunks(self.csvfile, chunksize))
+            self.assertEqual(self.data, list(numpy.concatenate(chunks)))
+            self.assertTrue(all(len(c) <= chunksize for c in chunks))
+
+    def test_iter_cipher_chunks_invalid(self):
+        """Test that non-numeric or out of range values are rejected."""
+        for text in ['1,2,x,4', '1,256,3']:
+            with open(self.csvfile, 'w') as f:
+                f.write(text)
+            with self.assertRaises(ValueError):
+                read_cipher(self.csvfile)
+
+    def test_convert_cipher(self):
+        """Test that a converted cipher file maps back to the same bytes."""
+        convert_cipher(self.csvfile, self.binfile)
+        data = load_cipher(self.binfile)
+        self.assertEqual(self.data, list(data))
+        chunks = list(iter_array_chunks(data, 300))
+        self.assertEqual([300, 300, 300, 100], [ len(c) for c in chunks ])
+
+    def test_xor_chunks(self):
+        """Test that chunked decryption matches fast_xor."""
+        chunks = iter_array_chunks(numpy.array(self.data, numpy.uint8), 7)
+        output = ''.join(c.tostring() for c in xor_chunks(chunks, 'abc'))
+        self.assertEqual(XORDecoder.fast_xor(self.data, 'abc'), output)
+        convert_cipher(self.csvfile, self.binfile)
+        chunks = list(xor_chunks(iter_array_chunks(load_cipher(self.binfile),
+                                                   300), 'abcd'))
+        self.assertEqual([300, 300, 300, 100], [ len(c) for c in chunks ])
+        self.assertEqual(XORDecoder.fast_xor(self.data, 'abcd'),
+                         ''.join(c.tostring() for c in chunks))
+
+
+class DictionaryIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dictfile = os.path.join(self.tmpdir, 'words')
+        self.indexfile = os.path.join(self.tmpdir, 'words.npy')
+        with open(self.dictfile, 'w') as f:
+            f.write('\n'.join(
+                "hotel alpha echo bravo golf delta foxtrot charlie".split()))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_membership(self):
+        """Test that the index contains exactly the dictionary words."""
+        index = load_dictionary_index(self.dictfile, self.indexfile)
+        self.assertTrue(os.path.exists(self.indexfile))
+        self.assertEqual(8, len(index))
+        for word in "alpha charlie hotel foxtrot".split():
+            self.assertIn(word, index)
+        for word in ["", "a", "alph", "alphas", "zulu", "foxtrotfoxtrot"]:
+            self.assertNotIn(word, index)
+        self.assertEqual(
+            [True, False, True, False, False],
+            list(index.contains_many(
+                ['alpha', 'alphas', 'hotel', 'zulu', 'charliecharlie'])))
+
+    def test_reuse_and_pickle(self):
+        """Test that an existing index is reused, and that pickling an
+        index preserves its contents."""
+        DictionaryIndex.build(['zulu'], self.indexfile)
+        os.utime(self.dictfile, (0, 0))
+        index = load_dictionary_index(self.dictfile, self.indexfile)
+        self.assertIn('zulu', index)
+        copy = pickle.loads(pickle.dumps(index))
+        self.assertEqual(1, len(copy))
+        self.assertIn('zulu', copy)
+
+    def test_index_name_without_npy(self):
+        """Test that an index file not named *.npy is written and
+        reused under exactly that name."""
+        indexfile = os.path.join(self.tmpdir, 'words.idx')
+        index = load_dictionary_index(self.dictfile, indexfile)
+        self.assertEqual(8, len(index))
+        self.assertTrue(os.path.exists(indexfile))
+        self.assertFalse(os.path.exists(indexfile + '.npy'))
+        # An up to date index is reused rather than rebuilt.
+        os.utime(self.dictfile, (0, 0))
+        os.utime(indexfile, (1000, 1000))
+        load_dictionary_index(self.dictfile, indexfile)
+        self.assertEqual(1000, os.path.getmtime(indexfile))
+
+    def test_decipher_with_index(self):
+        """Test that decipher() works with an indexed dictionary."""
+        xd = XORDecoder(dictfile=self.dictfile, indexfile=self.indexfile)
+        self.assertIsInstance(xd.dictionary(), DictionaryIndex)
+        src = 'alpha bravo foxtrot charlie foxtrot golf hotel'
+        cipher = XORDecoder.fast_xor([ord(x) for x in src], 'fox')
+        cipherdata = [ord(x) for x in cipher]
+        self.assertEqual(src, xd.decipher(cipherdata))
+        self.assertEqual(src, xd.decipher(cipherdata, workers=2))
+
+
+class BatchXorTest(unittest.TestCase):
+    def test_batch_xor(self):
+        """Test that BatchXOR agrees with fast_xor for every key."""
+        msg = [ord(x) for x in 'The quick brown fox']
+        keys = ['abc', 'xyz', 'fox']
+        batcher = BatchXOR(msg, 3)
+        output = batcher.xor([[ord(c) for c in k] for k in keys])
+        self.assertEqual((3, len(msg)), output.shape)
+        for i, key in enumerate(keys):
+            self.assertEqual(XORDecoder.fast_xor(msg, key),
+                             output[i].tostring())
+
+    def test_batch_xor_long_key(self):
+        """Test BatchXOR with a key longer than its message."""
+        msg = [2, 13, 20]
+        output = BatchXOR(msg, 5).xor([[ord(c) for c in 'abcde']])
+        self.assertEqual(chr(2 ^ ord('a')) + chr(13 ^ ord('b')) +
+                         chr(20 ^ ord('c')), output[0].tostring())
+
+    def test_batch_xor_reuses_buffer(self):
+        """Test that smaller batches reuse the output buffer."""
+        msg = [2, 13, 20, 21]
+        batcher = BatchXOR(msg, 2)
+        first = batcher.xor([[1, 2], [3, 4], [5, 6]])
+        second = batcher.xor([[7, 8]])
+        self.assertTrue(numpy.may_share_memory(first, second))
+        self.assertEqual([2 ^ 7, 13 ^ 8, 20 ^ 7, 21 ^ 8], list(second[0]))
+
+
 class KeyGeneratorTest(unittest.TestCase):
     def test_key_generator(self):
         """Test that the key generator produces the expected
@@ -71,6 +233,48 @@ class KeyGeneratorTest(unittest.TestCase):
         self.assertEqual(keys[1], 'aab')
         self.assertEqual(keys[2], 'aac')
 
+    def test_key_generator_alphabet(self):
+        """Test that the key generator honors the decoder's alphabet and
+        range of key lengths."""
+        xd = XORDecoder(alphabet='ab', keylengths=(1, 2))
+        self.assertEqual(['a', 'b', 'aa', 'ab', 'ba', 'bb'],
+                         list(xd.key_generator()))
+        self.assertEqual(['aa', 'ab', 'ba', 'bb'], list(xd.key_generator(2)))
+
+    def test_key_batches(self):
+        """Test that key_batches() produces the same keys in the same
+        order as key_generator()."""
+        xd = XORDecoder()
+        batches = list(xd.key_batches(3, 1000))
+        self.assertEqual(18, len(batches))
+        self.assertEqual((1000, 3), batches[0].shape)
+        keys = [ k.tostring() for batch in batches for k in batch ]
+        self.assertEqual(list(xd.key_generator(3)), keys)
+
+
+class KeyLengthTest(unittest.TestCase):
+    def test_guess_key_lengths(self):
+        """Test that the true key length is guessed first."""
+        src = ("It was the best of times, it was the worst of times, it was "
+               "the age of wisdom, it was the age of foolishness, it was the "
+               "epoch of belief, it was the epoch of incredulity, it was the "
+               "season of Light, it was the season of Darkness, it was the "
+               "spring of hope, it was the winter of despair, we had "
+               "everything before us, we had nothing before us, we were all "
+               "going direct to Heaven, we were all going direct the other "
+               "way.")
+        for key in ['ab', 'fox', 'zebra', 'foxtrot', 'hotelbravo']:
+            cipher = XORDecoder.fast_xor([ord(x) for x in src], key)
+            xd = XORDecoder(keylengths=(1, 12))
+            lengths = xd.guess_key_lengths([ord(x) for x in cipher])
+            self.assertEqual(len(key), lengths[0])
+            self.assertEqual(range(1, 13), sorted(lengths))
+
+    def test_guess_key_lengths_short_message(self):
+        """Test that key lengths too long to score are still returned."""
+        xd = XORDecoder(keylengths=(2, 4))
+        self.assertEqual([2, 3, 4], xd.guess_key_lengths([1, 2, 3]))
+
 
 class DecipherTest(unittest.TestCase):
     """Test XORDecoder.decipher() calls with a known dictionary."""
@@ -120,6 +324,178 @@ class DecipherTest(unittest.TestCase):
         cipherdata = [ord(x) for x in cipher]
         self.assertEqual(None, self.xd.decipher(cipherdata))
 
+    def test_decipher_batched(self):
+        """Test that batched decipher() calls agree with unbatched ones."""
+        for src in ['alpha bravo foxtrot charlie foxtrot golf hotel',
+                    'alpha bravo charlie delta echo foxtrot']:
+            cipher = XORDecoder.fast_xor([ord(x) for x in src], 'fox')
+            cipherdata = [ord(x) for x in cipher]
+            self.assertEqual(self.xd.decipher(cipherdata),
+                             self.xd.decipher(cipherdata, batch_size=1000))
+
+    def test_decipher_batched_no_spaces(self):
+        """Test that batched decipher() calls find plaintexts that have
+        no spaces."""
+        xd = XORDecoder()
+        xd.set_dictionary(set(['expert', 'expect', 'delays', 'quickly',
+                               'arrived', 'sunshine', 'exceptionally',
+                               'beautiful']))
+        for src in ['expert\nexpect\ndelays\nquickly\narrived\nexp\n',
+                    'sunshine,exceptionally,beautiful.exp.exp']:
+            cipher = XORDecoder.fast_xor([ord(x) for x in src], 'exp')
+            cipherdata = [ord(x) for x in cipher]
+            self.assertEqual(src, xd.decipher(cipherdata))
+            self.assertEqual(src, xd.decipher(cipherdata, batch_size=4096))
+
+    def test_decipher_parallel_no_spaces(self):
+        """Test that parallel decipher() calls find plaintexts that have
+        no spaces."""
+        xd = XORDecoder()
+        xd.set_dictionary(set(['expert', 'expect', 'delays', 'quickly',
+                               'arrived']))
+        src = 'expert\nexpect\ndelays\nquickly\narrived\nexp\n'
+        cipher = XORDecoder.fast_xor([ord(x) for x in src], 'exp')
+        cipherdata = [ord(x) for x in cipher]
+        self.assertEqual(xd.decipher(cipherdata),
+                         xd.decipher(cipherdata, workers=2))
+        self.assertEqual(src, xd.decipher(cipherdata, workers=2))
+
+    def test_decipher_parallel(self):
+        """Test that parallel decipher() calls agree with sequential ones."""
+        for src in ['alpha bravo foxtrot charlie foxtrot golf hotel',
+                    'alpha bravo charlie delta echo foxtrot']:
+            cipher = XORDecoder.fast_xor([ord(x) for x in src], 'fox')
+            cipherdata = [ord(x) for x in cipher]
+            expected = self.xd.decipher(cipherdata)
+            self.assertEqual(expected,
+                             self.xd.decipher(cipherdata, workers=2))
+            self.assertEqual(
+                expected,
+                self.xd._parallel_decipher(cipherdata, 1000, 3,
+                                           shard_size=5000))
+
+    def test_decipher_unknown_key_length(self):
+        """Test that decipher() finds keys whose length is not known
+        in advance."""
+        xd = XORDecoder(alphabet='fox', keylengths=(1, 5))
+        xd.set_dictionary(self.xd.dictionary())
+        src = 'alpha bravo foxtrot charlie foxtrot golf hotel'
+        cipher = XORDecoder.fast_xor([ord(x) for x in src], 'fox')
+        cipherdata = [ord(x) for x in cipher]
+        self.assertEqual(src, xd.decipher(cipherdata))
+
+
+class CandidateFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.xd = XORDecoder()
+        self.xd.set_dictionary(
+            set("alpha bravo charlie delta echo foxtrot golf hotel".split()))
+
+    def test_filter_stages(self):
+        """Test that each stage eliminates the candidates it should."""
+        candidates = [
+            ('\x01\x02\x03\x04\x05 foxtrot foxtrot', 'fox'),  # printable
+            ('12345 67890 12345 foxtrot foxtrot', 'fox'),    # letters
+            ('alpha bravo charlie foxtrot golf', 'fox'),     # key
+            ('zulus zebra yodel foxtrot fox', 'fox'),        # words
+            ('alpha bravo Foxtrot foxtrot', 'fox'),          # passes
+        ]
+        width = max(len(src) for src, _ in candidates)
+        plaintexts = numpy.array(
+            [[ord(c) for c in src.ljust(width)] for src, _ in candidates],
+            dtype=numpy.uint8)
+        keys = numpy.array([[ord(c) for c in key] for _, key in candidates],
+                           dtype=numpy.uint8)
+        f = CandidateFilter(self.xd, min_printable=0.9, min_letters=0.6,
+                            min_spaces=0.05)
+        self.assertEqual([4], f.apply(plaintexts, keys))
+        self.assertEqual(5, f.candidates())
+        self.assertEqual([('printable', 1), ('letters', 1), ('key', 1),
+                          ('words', 1)], f.eliminated())
+        f.reset()
+        self.assertEqual(0, f.candidates())
+        # By default only the key and word stages are used.
+        f = CandidateFilter(self.xd)
+        self.assertEqual([0, 1, 4], f.apply(plaintexts, keys))
+        self.assertEqual([('printable', 0), ('letters', 0), ('key', 1),
+                          ('words', 1)], f.eliminated())
+
+    def test_filter_eliminates_most_keys(self):
+        """Test that nearly every wrong key is eliminated before the
+        word-level check."""
+        src = 'alpha bravo foxtrot charlie foxtrot golf hotel'
+        cipher = XORDecoder.fast_xor([ord(x) for x in src], 'fox')
+        self.assertEqual(src, self.xd.decipher([ord(x) for x in cipher],
+                                               batch_size=4096))
+        f = self.xd.candidate_filter()
+        eliminated = dict(f.eliminated())
+        self.assertLess(eliminated['words'] + 1, f.candidates() / 100)
+
+
+class FrequencyDecipherTest(unittest.TestCase):
+    """Test XORDecoder.frequency_decipher() calls with a known dictionary."""
+    def setUp(self):
+        self.xd = XORDecoder()
+        self.xd.set_dictionary(
+            set("alpha bravo charlie delta echo foxtrot golf hotel".split()))
+
+    def test_best_keys_order(self):
+        """Test that best_keys() generates keys by decreasing score."""
+        src = 'alpha bravo foxtrot charlie foxtrot golf hotel'
+        cipher = XORDecoder.fast_xor([ord(x) for x in src], 'fox')
+        scores = XORDecoder.column_scores([ord(x) for x in cipher], 3)
+        self.assertEqual((3, 26), scores.shape)
+        keys = [ k for k, _ in zip(XORDecoder.best_keys(scores), range(50)) ]
+        self.assertEqual(50, len(set(keys)))
+        self.assertEqual('fox', keys[0])
+
+    def test_frequency_decipher(self):
+        """Test that frequency_decipher() recovers the plaintext."""
+        src = 'alpha bravo foxtrot charlie foxtrot golf hotel'
+        cipher = XORDecoder.fast_xor([ord(x) for x in src], 'fox')
+        cipherdata = [ord(x) for x in cipher]
+        self.assertEqual(src, self.xd.frequency_decipher(cipherdata))
+
+    def test_frequency_decipher_long_key(self):
+        """Test that frequency_decipher() handles keys longer than three
+        characters."""
+        src = ('alpha bravo charlie delta echo foxtrot golf hotel ' * 8 +
+               'charlie golf')
+        key = 'foxtrot'
+        cipher = XORDecoder.fast_xor([ord(x) for x in src], key)
+        cipherdata = [ord(x) for x in cipher]
+        self.assertEqual(
+            src, self.xd.frequency_decipher(cipherdata, keylen=len(key)))
+        # The key length can also be detected automatically.
+        xd = XORDecoder(keylengths=(1, 12))
+        xd.set_dictionary(self.xd.dictionary())
+        self.assertEqual(src, xd.frequency_decipher(cipherdata))
+
+    def test_stream_decipher(self):
+        """Test that stream_decipher() finds the key from a sequence of
+        chunks that do not line up with the key."""
+        src = ('alpha bravo charlie delta echo foxtrot golf hotel ' * 8 +
+               'charlie golf')
+        key = 'foxtrot'
+        cipher = numpy.frombuffer(
+            XORDecoder.fast_xor([ord(x) for x in src], key), numpy.uint8)
+        xd = XORDecoder(keylengths=(1, 12))
+        xd.set_dictionary(self.xd.dictionary())
+        for chunksize in [5, 64, 1000]:
+            self.assertEqual(key, xd.stream_decipher(
+                iter_array_chunks(cipher, chunksize), sample_size=100))
+            self.assertEqual(key, xd.stream_decipher(
+                iter_array_chunks(cipher, chunksize), keylen=7))
+        self.assertEqual(None, xd.stream_decipher([]))
+
+    def test_frequency_decipher_fails(self):
+        """Test that frequency_decipher() fails when the plaintext does
+        not satisfy the decryption conditions."""
+        src = 'alpha bravo charlie delta echo foxtrot'
+        cipher = XORDecoder.fast_xor([ord(x) for x in src], 'fox')
+        cipherdata = [ord(x) for x in cipher]
+        self.assertEqual(None, self.xd.frequency_decipher(cipherdata))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -22,13 +22,252 @@
 # against this record to avoid recomputing the square digit chain.
 # Note that we can save a lot of work by recording the result for each
 # intermediate number we generate.
+#
+# That still takes time and memory linear in the limit.  But the next
+# number in a chain depends only on the digits of n, and it is never
+# more than 81 times the number of digits, so only that many chains
+# need following.  count_89() instead counts how many numbers below
+# the limit have each square digit sum, by dynamic programming over
+# their digits, and adds up the counts for the sums whose chains
+# arrive at 89.  This takes time and memory roughly proportional to
+# the square of the number of digits in the limit.
+#
+# When the outcome for every number is wanted, scan_chains() computes
+# the square digit sums of a whole block of numbers at a time with
+# numpy, looks each one up in a uint8 table of chain ends, and stores
+# the outcomes packed eight to a byte.
+#
+# DigitChain generalizes all of this to chains that sum any power of
+# the digits in any base.  For k-digit numbers, the next number is at
+# most k*(base-1)**power, so every chain enters the range [0, M] for
+# some bound M that maps into itself.  The cycles that chains end in
+# are found once, for every number up to M together, by pointer
+# doubling: after jumping 2**j steps ahead for 2**j > M, every number
+# has landed on its cycle, and the smallest number seen on the way
+# around the cycle identifies it.  Starts are then counted per cycle
+# with the same digit DP as count_89().
 
 import time
 
+import numpy
+
 def square_digits(n):
     """Return the sum of the squares of the digits in n."""
     return sum([int(c)**2 for c in str(n)])
 
+def to_digits(n, base=10):
+    "Returns a list of the digits of N in BASE, most significant first."
+    digits = []
+    while True:
+        n, d = divmod(n, base)
+        digits.append(d)
+        if n == 0:
+            return digits[::-1]
+
+def digit_power_counts(ndigits, power, base):
+    """Returns a list counts, where counts[k][s] is the number of
+    strings of k digits in BASE (including leading zeros) whose digits
+    raised to POWER sum to s, for each k up to NDIGITS."""
+    # Counts may exceed 2**64, so they are kept as Python ints in numpy
+    # object arrays.
+    terms = [d ** power for d in xrange(base)]
+    counts = [numpy.array([1], dtype=object)]
+    for k in xrange(ndigits):
+        prev = counts[-1]
+        cur = numpy.zeros(len(prev) + terms[-1], dtype=object)
+        for t in terms:
+            cur[t:t + len(prev)] += prev
+        counts.append(cur)
+    return [c.tolist() for c in counts]
+
+def digit_power_histogram(maxn, power, base):
+    """Returns a list hist, where hist[s] is the number of integers n
+    with 0 <= n < MAXN whose digits in BASE, raised to POWER, sum to s.
+    """
+    digits = to_digits(maxn, base)
+    counts = digit_power_counts(len(digits) - 1, power, base)
+    hist = numpy.zeros((base - 1) ** power * len(digits) + 1, dtype=object)
+    # Every n below maxn matches maxn up to some digit, which is
+    # smaller in n, and is followed by any digits at all.
+    prefix = 0
+    for i, digit in enumerate(digits):
+        rest = numpy.array(counts[len(digits) - i - 1], dtype=object)
+        for d in xrange(digit):
+            offset = prefix + d ** power
+            hist[offset:offset + len(rest)] += rest
+        prefix += digit ** power
+    return hist.tolist()
+
+def square_sum_counts(ndigits):
+    """Returns a list counts, where counts[k][s] is the number of
+    strings of k decimal digits (including leading zeros) whose digit
+    squares sum to s, for each k up to NDIGITS."""
+    return digit_power_counts(ndigits, 2, 10)
+
+def square_sum_histogram(maxn):
+    """Returns a list hist, where hist[s] is the number of integers n
+    with 0 <= n < MAXN whose digit squares sum to s."""
+    return digit_power_histogram(maxn, 2, 10)
+
+def chain_ends(limit):
+    """Returns a list ends, where ends[n] is the number (1 or 89) at
+    which the square digit chain starting at n arrives, for each
+    0 < n <= LIMIT.  ends[0] is 0."""
+    ends = [0] * (limit + 1)
+    known = {1: 1, 89: 89}
+    for n in xrange(1, limit + 1):
+        nums = []
+        i = n
+        while i not in known:
+            nums.append(i)
+            i = square_digits(i)
+        for j in nums:
+            known[j] = known[i]
+        ends[n] = known[n]
+    return ends
+
+def count_89(maxn):
+    """Returns the number of starting numbers below MAXN whose square
+    digit chains arrive at 89."""
+    hist = square_sum_histogram(maxn)
+    ends = chain_ends(len(hist) - 1)
+    return sum(c for s, c in enumerate(hist) if ends[s] == 89)
+
+def digit_power_sums(numbers, power=2, base=10, dtype=numpy.uint64):
+    """Returns an array of type DTYPE of the sum of the digits in BASE
+    of each of NUMBERS, each raised to POWER."""
+    numbers = numpy.array(numbers, dtype=numpy.uint64)
+    sums = numpy.zeros(len(numbers), dtype=dtype)
+    base = numpy.uint64(base)
+    while numbers.any():
+        numbers, digits = numpy.divmod(numbers, base)
+        sums += digits.astype(dtype) ** power
+    return sums
+
+def square_digit_sums(numbers):
+    """Returns a uint16 array of the sum of the squares of the digits
+    of each of NUMBERS."""
+    return digit_power_sums(numbers, 2, 10, numpy.uint16)
+
+def terminal_table(limit):
+    "Returns chain_ends(LIMIT) as a uint8 array."
+    return numpy.array(chain_ends(limit), dtype=numpy.uint8)
+
+def scan_chains(maxn, blocksize=1 << 20):
+    """Returns a bit-packed array (see numpy.packbits) whose bit n is
+    set if the square digit chain starting at n arrives at 89, for each
+    0 <= n < MAXN.  Numbers are scanned BLOCKSIZE at a time."""
+    ends = terminal_table(81 * len(str(maxn)))
+    # Packing whole blocks keeps each block's bits byte-aligned.
+    blocksize -= blocksize % 8
+    packed = numpy.empty((maxn + 7) // 8, dtype=numpy.uint8)
+    for lo in xrange(0, maxn, blocksize):
+        hi = min(lo + blocksize, maxn)
+        sums = square_digit_sums(numpy.arange(lo, hi, dtype=numpy.uint64))
+        packed[lo//8:(hi+7)//8] = numpy.packbits(ends[sums] == 89)
+    return packed
+
+def scan_count_89(maxn, blocksize=1 << 20):
+    """Returns the same count as count_89(), by scanning every number
+    below MAXN with scan_chains()."""
+    packed = scan_chains(maxn, blocksize)
+    return int(numpy.unpackbits(packed).sum(dtype=numpy.int64))
+
+class DigitChain:
+    """Chains made by repeatedly replacing a number with the sum of its
+    digits in BASE, each raised to POWER.
+
+    Every such chain ends in a cycle, which is identified by a tuple of
+    its members, starting with the smallest.  Square digit chains, for
+    example, end in (1,) or (4, 16, 37, 58, 89, 145, 42, 20).  The
+    cycles are found the first time they are needed, using memory
+    proportional to bound().
+    """
+
+    def __init__(self, power=2, base=10):
+        self.power = power
+        self.base = base
+        self._bound = None
+        self._reps = None
+        self._cycles = None
+
+    def next(self, n):
+        "Returns the number following N in its chain."
+        return sum(d ** self.power for d in to_digits(n, self.base))
+
+    def bound(self):
+        """Returns a bound M such that every number from 0 to M is
+        followed by a number no greater than M."""
+        if self._bound is None:
+            top = (self.base - 1) ** self.power
+            bound = top
+            while len(to_digits(bound, self.base)) * top > bound:
+                bound = len(to_digits(bound, self.base)) * top
+            self._bound = bound
+        return self._bound
+
+    def representatives(self):
+        """Returns an array whose element n is the smallest member of
+        the cycle that the chain starting at n ends in, for each n from
+        0 to bound()."""
+        if self._reps is None:
+            size = self.bound() + 1
+            jump = digit_power_sums(numpy.arange(size), self.power,
+                                    self.base).astype(numpy.int64)
+            low = numpy.arange(size, dtype=numpy.int64)
+            # After each round, jump[n] is 2**j steps ahead of n, and
+            # low[n] is the smallest of the 2**j numbers from n on.
+            for j in xrange(size.bit_length()):
+                low = numpy.minimum(low, low[jump])
+                jump = jump[jump]
+            # jump[n] is now on a cycle no longer than 2**j, so low
+            # there holds the smallest member of the whole cycle.
+            self._reps = low[jump]
+        return self._reps
+
+    def attractors(self):
+        """Returns a dict mapping the smallest member of each cycle
+        that a chain starting from 1 or more ends in to that cycle."""
+        if self._cycles is None:
+            self._cycles = {}
+            for rep in numpy.unique(self.representatives()[1:]):
+                rep = int(rep)
+                cycle = [rep]
+                n = self.next(rep)
+                while n != rep:
+                    cycle.append(n)
+                    n = self.next(n)
+                self._cycles[rep] = tuple(cycle)
+        return self._cycles
+
+    def attractor(self, n):
+        "Returns the cycle that the chain starting at N ends in."
+        while n > self.bound():
+            n = self.next(n)
+        return self.attractors()[int(self.representatives()[n])]
+
+    def histogram(self, maxn):
+        """Returns a dict mapping each cycle to the number of starting
+        numbers from 1 to MAXN-1 whose chains end in it."""
+        hist = numpy.array(
+            digit_power_histogram(maxn, self.power, self.base), dtype=object)
+        if maxn > 0:
+            # Leave out 0, the only number whose digits sum to 0.
+            hist[0] -= 1
+        sums = numpy.flatnonzero(hist)
+        hist = hist[sums]
+        # Follow any sums above the bound until they fall within it.
+        sums = sums.astype(numpy.uint64)
+        above = sums > self.bound()
+        while above.any():
+            sums[above] = digit_power_sums(sums[above], self.power, self.base)
+            above = sums > self.bound()
+        reps = self.representatives()[sums]
+        counts = {}
+        for rep, cycle in self.attractors().iteritems():
+            counts[cycle] = sum(hist[reps == rep].tolist())
+        return counts
+
 def loop(maxn):
     # The "chain" array records the ultimate value (1 or 89) for
     # the square digit chain starting with each index i.
@@ -53,8 +292,8 @@ def loop(maxn):
 
 if __name__ == '__main__':
     t1 = time.clock()
-    count_89 = loop(10000000)
+    count = count_89(10000000)
     t2 = time.clock()
-    print count_89
+    print count
     print "{} seconds".format(t2 - t1)
 
@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+
+import unittest
+
+import numpy
+
+import p092
+
+class TestEuler92(unittest.TestCase):
+    def test_square_digits(self):
+        self.assertEqual(0, p092.square_digits(0))
+        self.assertEqual(32, p092.square_digits(44))
+        self.assertEqual(145, p092.square_digits(89))
+
+    def test_square_sum_counts(self):
+        counts = p092.square_sum_counts(2)
+        self.assertEqual([1], counts[0])
+        self.assertEqual([1 if s in (0, 1, 4, 9, 16, 25, 36, 49, 64, 81)
+                          else 0 for s in range(82)], counts[1])
+        self.assertEqual(100, sum(counts[2]))
+        # 01, 10; 05, 50, 34, 43
+        self.assertEqual(2, counts[2][1])
+        self.assertEqual(4, counts[2][25])
+
+    def test_square_sum_histogram(self):
+        for maxn in [0, 1, 9, 10, 99, 100, 1234, 4321]:
+            expected = [0] * (81 * len(str(maxn)) + 1)
+            for n in range(maxn):
+                expected[p092.square_digits(n)] += 1
+            self.assertEqual(expected, p092.square_sum_histogram(maxn))
+
+    def test_chain_ends(self):
+        ends = p092.chain_ends(100)
+        self.assertEqual(0, ends[0])
+        self.assertEqual(1, ends[1])
+        self.assertEqual(1, ends[44])
+        self.assertEqual(89, ends[85])
+        self.assertEqual(89, ends[89])
+        self.assertTrue(all(e in (1, 89) for e in ends[1:]))
+
+    def test_square_digit_sums(self):
+        numbers = [0, 7, 44, 89, 9999999, 10**15 + 12]
+        self.assertEqual([p092.square_digits(n) for n in numbers],
+                         p092.square_digit_sums(numbers).tolist())
+
+    def test_terminal_table(self):
+        table = p092.terminal_table(200)
+        self.assertEqual('uint8', table.dtype.name)
+        self.assertEqual(p092.chain_ends(200), table.tolist())
+
+    def test_scan_chains(self):
+        ends = p092.chain_ends(1000)
+        for maxn, blocksize in [(1000, 1 << 20), (1000, 64), (997, 100)]:
+            packed = p092.scan_chains(maxn, blocksize)
+            self.assertEqual((maxn + 7) // 8, len(packed))
+            bits = numpy.unpackbits(packed)[:maxn]
+            self.assertEqual([e == 89 for e in ends[:maxn]],
+                             bits.astype(bool).tolist())
+        self.assertEqual(p092.count_89(12345), p092.scan_count_89(12345, 256))
+        self.assertEqual(0, p092.scan_count_89(0))
+
+    def test_to_digits(self):
+        self.assertEqual([0], p092.to_digits(0))
+        self.assertEqual([1, 2, 3], p092.to_digits(123))
+        self.assertEqual([1, 1, 0, 1], p092.to_digits(13, 2))
+
+    def test_digit_power_histogram(self):
+        for maxn, power, base in [(100, 3, 10), (200, 2, 3), (4096, 4, 8)]:
+            chain = p092.DigitChain(power, base)
+            hist = p092.digit_power_histogram(maxn, power, base)
+            expected = [0] * len(hist)
+            for n in range(maxn):
+                expected[chain.next(n)] += 1
+            self.assertEqual(expected, hist)
+
+    def test_digit_chain(self):
+        chain = p092.DigitChain()
+        self.assertEqual(145, chain.next(89))
+        self.assertTrue(all(chain.next(n) <= chain.bound()
+                            for n in range(chain.bound() + 1)))
+        square_cycle = (4, 16, 37, 58, 89, 145, 42, 20)
+        self.assertEqual({1: (1,), 4: square_cycle}, chain.attractors())
+        self.assertEqual(square_cycle, chain.attractor(85))
+        self.assertEqual((1,), chain.attractor(10**30))
+        hist = chain.histogram(10**7)
+        self.assertEqual(8581146, hist[square_cycle])
+        self.assertEqual(10**7 - 1, sum(hist.values()))
+        self.assertEqual(p092.count_89(10**20),
+                         chain.histogram(10**20)[square_cycle])
+
+    def test_digit_chain_cubes(self):
+        chain = p092.DigitChain(3)
+        self.assertEqual(
+            [(1,), (55, 250, 133), (136, 244), (153,), (160, 217, 352),
+             (370,), (371,), (407,), (919, 1459)],
+            sorted(chain.attractors().values()))
+        hist = chain.histogram(2000)
+        expected = dict.fromkeys(hist, 0)
+        for n in range(1, 2000):
+            expected[chain.attractor(n)] += 1
+        self.assertEqual(expected, hist)
+
+    def test_digit_chain_bases(self):
+        self.assertEqual({(1,): 99}, p092.DigitChain(2, 2).histogram(100))
+        self.assertEqual({(1,): 29, (2, 4): 43, (5,): 21, (8,): 6},
+                         p092.DigitChain(2, 3).histogram(100))
+        self.assertEqual({(1,): 0, (2, 4): 0, (5,): 0, (8,): 0},
+                         p092.DigitChain(2, 3).histogram(1))
+
+    def test_count_89(self):
+        for maxn in [1000, 12345]:
+            self.assertEqual(p092.loop(maxn), p092.count_89(maxn))
+        self.assertEqual(0, p092.count_89(1))
+        self.assertEqual(8581146, p092.count_89(10**7))
+        self.assertEqual(87994965555707002706, p092.count_89(10**20))
+
+
+if __name__ == '__main__':
+    unittest.main()
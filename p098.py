@@ -38,6 +38,32 @@
 #     a. Hash the word into an anagram bucket.
 #     b. Eliminate any words that have no anagrams in the dictionary.
 #
+#    Words are streamed from the input file into an AnagramIndex, which
+#    buckets them by length and by a prime-product signature of their
+#    letters.  Computing the signature is linear in the length of the
+#    word, and a word without anagrams is kept only as a bare string.
+#
+# Squares are looked up in a SquareIndex, which groups the squares of
+# each length by their lexical pattern.  A word then needs one pattern
+# computation and a dict lookup to find all the squares it may map to.
+# The index can be saved to a cache file and reused between runs.
+#
+# Inside the search, lexical patterns are encoded as integers: the
+# labels 0, 1, 2, ... packed as decimal digits.  A square has at most
+# ten distinct digits, so its labels fit in one decimal digit each,
+# and the patterns for a whole array of squares can be computed at
+# once from their digit matrix.  Likewise, the squares that a word
+# maps to are translated to each of its anagrams by indexing the
+# digit matrix with a permutation of its columns.
+#
+# The anagram groups of each length may be searched by a pool of
+# worker processes.  Every square anagram pair is found starting from
+# the word that maps to the larger square, so squares no larger than
+# the best found so far (or the N-th best, when looking for the top N)
+# need not be tried; the workers share that bound through shared
+# memory.  The pool is shut down as soon as enough squares have been
+# found that no shorter words can improve on them.
+#
 # 2. Iterate over the anagram buckets, starting with the longest word length.
 #     a. Calculate the square numbers that have the same number of digits.
 #        Group them by lexical pattern.
@@ -46,10 +72,17 @@
 #     b. Loop through each word/square pair, and determine whether
 #        the anagrammed word also maps to a square.
 
+import argparse
+import cPickle as pickle
 import csv
-import math
+import heapq
+import multiprocessing
+import os
+import string
 import time
 
+import numpy
+
 def read_words(infile):
     """Reads words stored in CSV file INFILE.
     Returns a dict of words grouped into anagram buckets.
@@ -58,9 +91,104 @@ def read_words(infile):
     with open(infile, 'r') as f:
         csv_reader = csv.reader(f)
         for row in csv_reader:
-            words = words + row
+            words.extend(row)
     return words
 
+def iter_words(infile, chunksize=1 << 16):
+    """Generates the words stored in CSV file INFILE one at a time,
+    reading chunksize characters at a time.  Words are separated by
+    commas or newlines, and surrounding double quotes are removed.
+    """
+    with open(infile, 'r') as f:
+        tail = ''
+        while True:
+            text = f.read(chunksize)
+            if not text:
+                break
+            fields = (tail + text).replace('\n', ',').split(',')
+            # The last field may continue in the next chunk.
+            tail = fields.pop()
+            for field in fields:
+                word = field.strip().strip('"')
+                if word:
+                    yield word
+        word = tail.strip().strip('"')
+        if word:
+            yield word
+
+# Each letter is assigned a distinct prime, so that the product of the
+# primes for a word's letters is the same for exactly its anagrams.
+LETTER_PRIMES = dict(zip(
+    string.ascii_uppercase,
+    [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61,
+     67, 71, 73, 79, 83, 89, 97, 101]))
+
+def letter_signature(word):
+    """Returns a signature for WORD which is equal for two words if and
+    only if they are anagrams of each other.
+
+    For a word of uppercase letters, this is the product of the primes
+    in LETTER_PRIMES for each of its letters.  Any other word falls back
+    to the string of its characters in sorted order.
+    """
+    signature = 1
+    try:
+        for ch in word:
+            signature *= LETTER_PRIMES[ch]
+    except KeyError:
+        return ''.join(sorted(word))
+    return signature
+
+class AnagramIndex:
+    """Groups words into anagram buckets as they are added, keeping a
+    separate set of buckets for each word length.
+
+    A bucket holding a single word is stored as that bare string, and
+    only becomes a set once a second anagram arrives, so words without
+    anagrams cost little more than the string itself.  prune() drops
+    them altogether once all of the words have been added.
+    """
+
+    def __init__(self, words=()):
+        # _buckets[length][signature] is a word, or a set of anagrams.
+        self._buckets = {}
+        for w in words:
+            self.add(w)
+
+    def add(self, word):
+        buckets = self._buckets.setdefault(len(word), {})
+        signature = letter_signature(word)
+        bucket = buckets.get(signature)
+        if bucket is None:
+            buckets[signature] = word
+        elif isinstance(bucket, set):
+            bucket.add(word)
+        elif bucket != word:
+            buckets[signature] = set([bucket, word])
+
+    def prune(self):
+        """Removes every word that has no anagrams."""
+        for length in self._buckets.keys():
+            buckets = self._buckets[length]
+            for signature in buckets.keys():
+                if not isinstance(buckets[signature], set):
+                    del buckets[signature]
+            if not buckets:
+                del self._buckets[length]
+
+    def lengths(self):
+        """Returns the lengths of words that have anagrams, longest
+        first."""
+        return sorted((length for length, buckets in self._buckets.iteritems()
+                       if any(isinstance(b, set) for b in buckets.itervalues())),
+                      reverse=True)
+
+    def groups(self, length):
+        """Returns a list of the anagram groups (sets of at least two
+        words) of the given length."""
+        return [ b for b in self._buckets.get(length, {}).itervalues()
+                 if isinstance(b, set) ]
+
 def collect_anagrams(words):
     """Groups each word in WORDS (a list of strings) into anagram groups.
 
@@ -105,58 +233,310 @@ def translate(word1, key, word2):
     key = dict(zip(word1, key))
     return ''.join(key[sym] for sym in word2)
 
+def pattern_code(s):
+    """Returns the lexical pattern of string s encoded as an integer,
+    whose decimal digits are the labels 0, 1, 2, ... assigned to each
+    symbol in order of first appearance.  For example, the pattern
+    code of 'KNEE' (pattern ABCC) is 122.
+
+    Returns None if s has more than ten distinct symbols, since it can
+    then not match any number.
+    """
+    labels = {}
+    code = 0
+    for sym in s:
+        label = labels.setdefault(sym, len(labels))
+        if label > 9:
+            return None
+        code = code * 10 + label
+    return code
+
+def digit_matrix(numbers, ndigits):
+    """Returns a uint8 array with one row for each number in NUMBERS,
+    holding its NDIGITS least significant decimal digits, most
+    significant digit first."""
+    numbers = numpy.array(numbers, dtype=numpy.uint64)
+    digits = numpy.empty((len(numbers), ndigits), dtype=numpy.uint8)
+    for j in xrange(ndigits - 1, -1, -1):
+        numbers, digits[:, j] = numpy.divmod(numbers, numpy.uint64(10))
+    return digits
+
+def matrix_numbers(digits):
+    "Returns the numbers whose decimal digits are the rows of DIGITS."
+    ndigits = digits.shape[1]
+    powers = numpy.uint64(10) ** numpy.arange(ndigits - 1, -1, -1,
+                                              dtype=numpy.uint64)
+    return digits.astype(numpy.uint64).dot(powers)
+
+def pattern_codes(digits):
+    """Returns the pattern_code() of each row of the digit matrix
+    DIGITS, as a uint64 array."""
+    nrows, ndigits = digits.shape
+    rows = numpy.arange(nrows)
+    # labels[i, d] is the label given to digit d in row i, or -1.
+    labels = numpy.full((nrows, 10), -1, dtype=numpy.int8)
+    nlabels = numpy.zeros(nrows, dtype=numpy.int8)
+    codes = numpy.zeros(nrows, dtype=numpy.uint64)
+    for j in xrange(ndigits):
+        column = digits[:, j]
+        label = labels[rows, column]
+        new = label < 0
+        label[new] = nlabels[new]
+        labels[rows[new], column[new]] = nlabels[new]
+        nlabels += new
+        codes = codes * numpy.uint64(10) + label.astype(numpy.uint64)
+    return codes
+
+def permutations(word, anagrams):
+    """Returns a list with an index array for each of ANAGRAMS, which
+    selects the letters of WORD in the order they appear in that
+    anagram.  Indexing the digits of a number that WORD maps to with
+    it gives the number that the anagram maps to; see translate().
+
+    Raises ValueError if an anagram has a letter that is not in WORD.
+    """
+    return [ numpy.array([word.index(sym) for sym in ana], dtype=numpy.intp)
+             for ana in anagrams ]
+
+def isqrt(n):
+    "Returns the largest integer whose square is no greater than N."
+    if n < 0:
+        raise ValueError("square root of negative number")
+    if n == 0:
+        return 0
+    # Newton's method, starting from a power of two above the root.
+    x = 1 << ((n.bit_length() + 1) // 2)
+    while True:
+        y = (x + n // x) // 2
+        if y >= x:
+            return x
+        x = y
+
 def calculate_squares(ndigits):
     "Returns a list of square numbers which are each NDIGITS long."
-    root = int(math.sqrt(10**ndigits - 1))
-    squares = []
-    while root > 0 and len(str(root*root)) == ndigits:
-        squares.append(root*root)
-        root -= 1
-    return squares
+    if ndigits < 1:
+        return []
+    lo = isqrt(10**(ndigits-1) - 1) + 1
+    hi = isqrt(10**ndigits - 1)
+    return [ root*root for root in xrange(hi, lo - 1, -1) ]
+
+# The longest squares that fit in a uint64.
+MAX_SQUARE_DIGITS = 19
 
-def findmaxsquare(inputfile):
-    words = read_words(inputfile)
-    all_anagrams = collect_anagrams(words)
-    # Select only anagram groups with at least two words.
-    all_anagrams = {k: group
-                    for (k, group) in all_anagrams.iteritems()
-                    if len(group) > 1}
+# Bumped whenever the format of the SquareIndex cache file changes.
+SQUARE_INDEX_VERSION = 2
+
+NO_SQUARES = numpy.zeros(0, dtype=numpy.uint64)
+
+class SquareIndex:
+    """An index of square numbers, keyed by their number of digits and
+    the pattern_code() of their lexical pattern.
+
+    The squares of each length are indexed the first time they are
+    asked for.  If cachefile is given, the index is loaded from it, and
+    is saved back to it whenever squares of a new length are indexed.
+    A cache file written in an older format is ignored.
+    """
+
+    def __init__(self, cachefile=None):
+        self.cachefile = cachefile
+        # _patterns[ndigits][code] is a uint64 array of squares,
+        # largest first.
+        self._patterns = {}
+        if cachefile and os.path.exists(cachefile):
+            try:
+                with open(cachefile, 'rb') as f:
+                    cache = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError, AttributeError,
+                    ImportError, IndexError, TypeError, ValueError):
+                cache = None
+            if (isinstance(cache, tuple) and len(cache) == 2 and
+                    cache[0] == SQUARE_INDEX_VERSION):
+                self._patterns = cache[1]
+
+    def patterns(self, ndigits):
+        """Returns a dict mapping each pattern code to the array of
+        NDIGITS-long squares that have that pattern.
+
+        Raises ValueError if NDIGITS is more than MAX_SQUARE_DIGITS.
+        """
+        if ndigits > MAX_SQUARE_DIGITS:
+            raise ValueError(
+                "squares longer than {} digits are not supported".format(
+                    MAX_SQUARE_DIGITS))
+        if ndigits not in self._patterns:
+            patterns = {}
+            if ndigits > 0:
+                lo = isqrt(10**(ndigits-1) - 1) + 1
+                hi = isqrt(10**ndigits - 1)
+                roots = numpy.arange(hi, lo - 1, -1, dtype=numpy.uint64)
+                squares = roots * roots
+                codes = pattern_codes(digit_matrix(squares, ndigits))
+                # A stable sort keeps each pattern's squares in
+                # descending order.
+                order = numpy.argsort(codes, kind='mergesort')
+                codes, squares = codes[order], squares[order]
+                starts = numpy.flatnonzero(
+                    numpy.concatenate(([True], codes[1:] != codes[:-1])))
+                for code, group in zip(codes[starts],
+                                       numpy.split(squares, starts[1:])):
+                    patterns[int(code)] = group
+            self._patterns[ndigits] = patterns
+            if self.cachefile:
+                self.save()
+        return self._patterns[ndigits]
+
+    def squares(self, ndigits, code):
+        """Returns an array of the NDIGITS-long squares with pattern
+        code CODE, largest first."""
+        return self.patterns(ndigits).get(code, NO_SQUARES)
+
+    def save(self):
+        """Writes the index to its cache file, replacing the file only
+        once it has been written completely."""
+        tmpfile = self.cachefile + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            pickle.dump((SQUARE_INDEX_VERSION, self._patterns), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, self.cachefile)
+
+def group_squares(anagrams, ndigits, square_index, bound=0):
+    """Returns a set of the squares formed by square anagram word pairs
+    among ANAGRAMS, a group of NDIGITS-long words, using SQUARE_INDEX
+    to look up squares.
+
+    Only pairs whose larger square is greater than BOUND are searched
+    for, but the smaller square of each such pair is included.
+    """
+    found = set()
+    for word in anagrams:
+        # For each word/square match, check whether any of the word's
+        # anagrams maps to another square.  A square that the word maps
+        # to is translated into a number with the anagram's pattern, so
+        # it need only be looked up among the squares with that pattern.
+        code = pattern_code(word)
+        if code is None:
+            continue
+        squares = square_index.squares(ndigits, code)
+        # Squares are sorted largest first.
+        squares = squares[:numpy.count_nonzero(squares > bound)]
+        if not len(squares):
+            continue
+        digits = digit_matrix(squares, ndigits)
+        others = [ ana for ana in anagrams if ana != word ]
+        for ana, perm in zip(others, permutations(word, others)):
+            sq2 = matrix_numbers(digits[:, perm])
+            matched = numpy.isin(
+                sq2, square_index.squares(ndigits, pattern_code(ana)))
+            found.update(int(sq) for sq in squares[matched])
+            found.update(int(sq) for sq in sq2[matched])
+    return found
+
+def kth_largest(values, k):
+    "Returns the Kth largest of VALUES, or 0 if there are fewer than K."
+    if len(values) < k:
+        return 0
+    return heapq.nlargest(k, values)[-1]
+
+def findmaxsquare(inputfile, cachefile=None, workers=None, top=None):
+    """Returns the largest square formed by any member of a square
+    anagram word pair in INPUTFILE, or 0 if there are none.  If
+    cachefile is given, it is used to save the square index.
+
+    If TOP is given, returns a list of the TOP largest such squares
+    instead, largest first.  If workers is given, the anagram groups
+    are searched by that many worker processes.
+    """
+    index = AnagramIndex(iter_words(inputfile))
+    index.prune()
+    square_index = SquareIndex(cachefile)
+    k = top or 1
 
     # Iterate over anagram groups, starting with the longest words,
     # and look for words that map to square numbers.
-    maxsq = 0
-    lastgroup = None
-    cached_squares = {}
-    for group in sorted(all_anagrams.keys(), key=len, reverse=True):
-        # If we have found at least one word/square match, and have
-        # moved on to a shorter group, we're not going to find a larger
-        # square and can quit.
-        if maxsq > 0 and lastgroup is not None and len(group) < len(lastgroup):
+    found = set()
+    for ndigits in index.lengths():
+        # If we have found enough squares, and have moved on to a
+        # shorter group, we're not going to find a larger square and
+        # can quit.
+        if len(found) >= k:
             break
-        lastgroup = group
-        anagrams = all_anagrams[group]
-        # Get a list of square numbers with the same number of digits
-        ndigits = len(group)
-        if ndigits not in cached_squares:
-            cached_squares[ndigits] = calculate_squares(ndigits)
-        squares = cached_squares[ndigits]
-        matches = [ (word, sq)
-                    for word in anagrams for sq in squares
-                    if lexical_pattern(word) == lexical_pattern(str(sq)) ]
-        # For each word/square match, check whether any of the word's anagrams
-        # maps to another square.
-        for word, sq in matches:
-            for ana in anagrams:
-                if word != ana:
-                    sq2 = int(translate(word, str(sq), ana))
-                    if sq2 in squares:
-                        maxsq = max(sq, sq2, maxsq)
-    return maxsq
+        groups = index.groups(ndigits)
+        if workers:
+            found.update(_parallel_group_squares(
+                groups, ndigits, square_index, workers, k))
+        else:
+            for anagrams in groups:
+                found.update(group_squares(anagrams, ndigits, square_index,
+                                           kth_largest(found, k)))
+
+    if top is None:
+        return max(found) if found else 0
+    return heapq.nlargest(top, found)
+
+def _parallel_group_squares(groups, ndigits, square_index, workers, k):
+    """Searches GROUPS of NDIGITS-long anagrams with a pool of worker
+    processes, and returns the set of squares found.
+
+    The squares for NDIGITS are indexed before the workers are started,
+    so they inherit the index rather than building it again.  The K-th
+    largest square known to any worker is published in a shared value,
+    which every worker uses as its search bound.
+    """
+    square_index.patterns(ndigits)
+    bound = multiprocessing.Value('L', 0)
+    pool = multiprocessing.Pool(workers, _init_square_worker,
+                                (square_index, ndigits, bound, k))
+    found = set()
+    try:
+        for squares in pool.imap_unordered(_search_group, groups):
+            found.update(squares)
+    finally:
+        pool.terminate()
+        pool.join()
+    return found
+
+# State for worker processes, set by _init_square_worker.
+_worker = {}
+
+def _init_square_worker(square_index, ndigits, bound, k):
+    _worker['square_index'] = square_index
+    _worker['ndigits'] = ndigits
+    _worker['bound'] = bound
+    _worker['k'] = k
+    _worker['found'] = set()
+
+def _search_group(anagrams):
+    """Searches one anagram group for square pairs, skipping any not
+    larger than the shared bound, and raises the bound if this worker
+    has now found at least k squares.  Returns the squares found.
+    """
+    bound = _worker['bound']
+    squares = group_squares(anagrams, _worker['ndigits'],
+                            _worker['square_index'], bound.value)
+    found = _worker['found']
+    found.update(squares)
+    # Every square this worker has found is a square of the whole
+    # search, so its k-th largest is a lower bound on the final one.
+    kth = kth_largest(found, _worker['k'])
+    if kth > bound.value:
+        with bound.get_lock():
+            bound.value = max(bound.value, kth)
+    return squares
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=None,
+                        help='search with this many worker processes')
+    parser.add_argument('--top', type=int, default=None,
+                        help='print the TOP largest squares')
+    parser.add_argument('--cache', default=None,
+                        help='file in which to save the square index')
+    args = parser.parse_args()
     t1 = time.clock()
-    maxsq = findmaxsquare(inputfile='p098_words.txt')
+    maxsq = findmaxsquare(inputfile='p098_words.txt', cachefile=args.cache,
+                          workers=args.workers, top=args.top)
     runtime = time.clock() - t1
     print maxsq
     print "{} seconds".format(runtime)
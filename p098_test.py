@@ -1,5 +1,9 @@
 #! /usr/bin/env python
 
+import cPickle as pickle
+import os
+import shutil
+import tempfile
 import unittest
 
 import p098
@@ -22,6 +26,129 @@ class TestEuler98(unittest.TestCase):
             p098.collect_anagrams(
                 ['OP', 'OPS', 'POS', 'POST', 'SOP', 'SPOT', 'STOP']))
 
+    def test_iter_words(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            infile = os.path.join(tmpdir, 'words.txt')
+            with open(infile, 'w') as f:
+                f.write('"CARE","RACE","A"\n"ACRE","OPS"')
+            for chunksize in [1, 2, 5, 1 << 16]:
+                self.assertEqual(['CARE', 'RACE', 'A', 'ACRE', 'OPS'],
+                                 list(p098.iter_words(infile, chunksize)))
+        finally:
+            shutil.rmtree(tmpdir)
+
+        words = list(p098.iter_words('p098_words.txt'))
+        self.assertEqual(p098.read_words('p098_words.txt'), words)
+
+    def test_letter_signature(self):
+        self.assertEqual(1, p098.letter_signature(''))
+        self.assertEqual(p098.letter_signature('POST'),
+                         p098.letter_signature('STOP'))
+        self.assertNotEqual(p098.letter_signature('POST'),
+                            p098.letter_signature('POSTS'))
+        self.assertNotEqual(p098.letter_signature('AAB'),
+                            p098.letter_signature('ABB'))
+        # Other characters fall back to a sorted string, case-sensitively.
+        self.assertEqual(p098.letter_signature('post'),
+                         p098.letter_signature('stop'))
+        self.assertNotEqual(p098.letter_signature('post'),
+                            p098.letter_signature('POST'))
+        self.assertEqual(p098.letter_signature("it's"),
+                         p098.letter_signature("sit'"))
+
+    def test_anagram_index(self):
+        index = p098.AnagramIndex(
+            ['OP', 'OPS', 'POS', 'POST', 'SOP', 'SPOT', 'STOP', 'SOP', 'A'])
+        self.assertEqual([4, 3], index.lengths())
+        self.assertEqual([set(['POST', 'SPOT', 'STOP'])], index.groups(4))
+        self.assertEqual([set(['SOP', 'OPS', 'POS'])], index.groups(3))
+        self.assertEqual([], index.groups(2))
+        index.prune()
+        self.assertEqual([4, 3], index.lengths())
+        self.assertEqual([], index.groups(1))
+
+    def test_findmaxsquare(self):
+        self.assertEqual(18769, p098.findmaxsquare('p098_words.txt'))
+        self.assertEqual(0, p098.findmaxsquare(os.devnull))
+
+    def test_findmaxsquare_mixed_case(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            infile = os.path.join(tmpdir, 'words.txt')
+            with open(infile, 'w') as f:
+                f.write('"care","race","Dog","god"')
+            self.assertEqual(9216, p098.findmaxsquare(infile))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_findmaxsquare_top(self):
+        all_squares = [18769, 17689, 9604, 9216, 4761, 4096, 2916, 2401,
+                       1936, 1764, 1369, 1296, 1024, 961, 625, 256, 196, 169]
+        self.assertEqual([18769],
+                         p098.findmaxsquare('p098_words.txt', top=1))
+        self.assertEqual(all_squares[:6],
+                         p098.findmaxsquare('p098_words.txt', top=6))
+        self.assertEqual(all_squares,
+                         p098.findmaxsquare('p098_words.txt', top=100))
+        self.assertEqual([], p098.findmaxsquare(os.devnull, top=3))
+
+    def test_findmaxsquare_parallel(self):
+        self.assertEqual(18769,
+                         p098.findmaxsquare('p098_words.txt', workers=2))
+        self.assertEqual(
+            p098.findmaxsquare('p098_words.txt', top=12),
+            p098.findmaxsquare('p098_words.txt', top=12, workers=3))
+
+    def test_group_squares(self):
+        index = p098.SquareIndex()
+        self.assertEqual(set([1296, 9216]),
+                         p098.group_squares(['CARE', 'RACE'], 4, index))
+        self.assertEqual(set([1296, 9216]),
+                         p098.group_squares(['CARE', 'RACE'], 4, index, 9000))
+        self.assertEqual(set(),
+                         p098.group_squares(['CARE', 'RACE'], 4, index, 9216))
+
+    def test_isqrt(self):
+        for n in range(1000):
+            root = p098.isqrt(n)
+            self.assertTrue(root*root <= n < (root+1)*(root+1))
+        self.assertEqual(10**20, p098.isqrt(10**40))
+        self.assertEqual(10**20 - 1, p098.isqrt(10**40 - 1))
+        with self.assertRaises(ValueError):
+            p098.isqrt(-4)
+
+    def test_square_index(self):
+        index = p098.SquareIndex()
+        self.assertEqual([961, 841, 784, 729, 625, 576, 529, 361, 324,
+                          289, 256, 196, 169],
+                         list(index.squares(3, p098.pattern_code('ABC'))))
+        self.assertEqual([900, 400, 144, 100],
+                         list(index.squares(3, p098.pattern_code('ABB'))))
+        self.assertEqual([], list(index.squares(3, p098.pattern_code('AAA'))))
+        self.assertEqual([1444],
+                         list(index.squares(4, p098.pattern_code('ABBB'))))
+        self.assertEqual(len(p098.calculate_squares(7)),
+                         sum(len(squares) for squares
+                             in index.patterns(7).itervalues()))
+        with self.assertRaises(ValueError):
+            index.patterns(20)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cachefile = os.path.join(tmpdir, 'squares.pickle')
+            self.assertEqual(
+                18769, p098.findmaxsquare('p098_words.txt', cachefile))
+            cached = p098.SquareIndex(cachefile)
+            self.assertEqual([5, 6, 8, 9], sorted(cached._patterns))
+            for code, squares in index.patterns(5).iteritems():
+                self.assertEqual(list(squares),
+                                 list(cached.squares(5, code)))
+            self.assertEqual(
+                18769, p098.findmaxsquare('p098_words.txt', cachefile))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_lexical_pattern(self):
         self.assertEqual('',            p098.lexical_pattern(''))
         self.assertEqual('ABCDEF',      p098.lexical_pattern('GARDEN'))
@@ -32,6 +159,62 @@ class TestEuler98(unittest.TestCase):
         self.assertEqual('ABCC',        p098.lexical_pattern('5311'))
         self.assertEqual('ABCADAEABCA', p098.lexical_pattern('ABRACADABRA'))
 
+    def test_square_index_old_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cachefile = os.path.join(tmpdir, 'squares.pickle')
+            # An unversioned cache, as written by earlier versions.
+            with open(cachefile, 'wb') as f:
+                pickle.dump({5: {'ABCDE': [98596]}, 6: {}}, f)
+            self.assertEqual({}, p098.SquareIndex(cachefile)._patterns)
+            self.assertEqual(
+                18769, p098.findmaxsquare('p098_words.txt', cachefile))
+            self.assertEqual(
+                [5, 6, 8, 9],
+                sorted(p098.SquareIndex(cachefile)._patterns))
+            # A cache from a different version, and a damaged cache.
+            with open(cachefile, 'wb') as f:
+                pickle.dump((p098.SQUARE_INDEX_VERSION + 1, {5: {}}), f)
+            self.assertEqual({}, p098.SquareIndex(cachefile)._patterns)
+            with open(cachefile, 'wb') as f:
+                f.write('not a pickle')
+            self.assertEqual({}, p098.SquareIndex(cachefile)._patterns)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_pattern_code(self):
+        self.assertEqual(0, p098.pattern_code(''))
+        self.assertEqual(12345, p098.pattern_code('GARDEN'))
+        self.assertEqual(12345, p098.pattern_code('615423'))
+        self.assertEqual(122, p098.pattern_code('KNEE'))
+        self.assertEqual(122, p098.pattern_code('5311'))
+        self.assertEqual(1203040120, p098.pattern_code('ABRACADABRA'))
+        self.assertEqual(123456789, p098.pattern_code('ABCDEFGHIJ'))
+        self.assertIsNone(p098.pattern_code('ABCDEFGHIJK'))
+
+    def test_pattern_codes(self):
+        numbers = [1296, 9216, 1444, 5, 100, 123456789012345]
+        digits = p098.digit_matrix(numbers, 4)
+        self.assertEqual([[1, 2, 9, 6], [9, 2, 1, 6], [1, 4, 4, 4],
+                          [0, 0, 0, 5], [0, 1, 0, 0], [2, 3, 4, 5]],
+                         digits.tolist())
+        self.assertEqual(numbers[:5] + [2345],
+                         p098.matrix_numbers(digits).tolist())
+        squares = p098.calculate_squares(6)
+        self.assertEqual(
+            [p098.pattern_code(str(sq)) for sq in squares],
+            p098.pattern_codes(p098.digit_matrix(squares, 6)).tolist())
+
+    def test_permutations(self):
+        perms = p098.permutations('CARE', ['RACE', 'CARE', 'ACRE'])
+        self.assertEqual([[2, 1, 0, 3], [0, 1, 2, 3], [1, 0, 2, 3]],
+                         [perm.tolist() for perm in perms])
+        digits = p098.digit_matrix([1296], 4)
+        self.assertEqual([9216],
+                         p098.matrix_numbers(digits[:, perms[0]]).tolist())
+        with self.assertRaises(ValueError):
+            p098.permutations('CARE', ['CARS'])
+
     def test_calculate_squares(self):
         self.assertItemsEqual([], p098.calculate_squares(0))
         self.assertItemsEqual([1, 4, 9], p098.calculate_squares(1))
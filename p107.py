@@ -18,13 +18,47 @@
 #
 # This program implements Kruskal's algorithm for finding a minimal
 # spanning tree as described in Steven Skiena's "The Algorithm Design
-# Manual", section 6.1.2.
+# Manual", section 6.1.2.  Edges are sorted once by weight, and a
+# union-find structure tracks the components, so the algorithm runs in
+# O(E log E) time.  For dense graphs, Prim's algorithm with a binary
+# heap is used instead (section 6.1.1).
+#
+# For very large graphs on multi-core machines, mintree() can also use
+# Boruvka's algorithm, which finds the cheapest edge leaving every
+# component at once and so splits naturally across processes.
+#
+# Graph stores the network as a dense V x V matrix, which is simple and
+# fast for small networks like this one.  SparseGraph provides the same
+# interface for large sparse networks, storing each undirected edge once
+# in numpy arrays, so its memory use is proportional to the number of
+# edges rather than to the square of the number of vertices.
+#
+# Both graph classes read network files with load_edge_arrays(), which
+# parses blocks of rows at a time with numpy and can keep the parsed
+# edges in a binary cache file for later runs.
 
-import csv
+import ctypes
+import hashlib
 import heapq
+import itertools
+import multiprocessing
+import os
+import re
 import time
 
-class Edge:
+import numpy
+
+class Edge(object):
+    """An edge between vertices v1 and v2 with the given weight.
+
+    Edges compare (and are equal) by weight alone.  Code that handles
+    large numbers of edges should use the plain (weight, v1, v2) tuples
+    produced by as_tuple() and edge_tuples(), which need no per-edge
+    object and compare in C, or the arrays from edge_arrays().
+    """
+
+    __slots__ = ('_v1', '_v2', '_weight')
+
     def __init__(self, v1, v2, weight):
         self._v1 = v1
         self._v2 = v2
@@ -39,35 +73,133 @@ class Edge:
     def weight(self):
         return self._weight
 
+    def as_tuple(self):
+        """Returns the tuple (weight, v1, v2) for this edge.  Tuples sort
+        by weight first, like Edge objects."""
+        return (self._weight, self._v1, self._v2)
+
     def __cmp__(self, other):
         return cmp(self.weight(), other.weight())
 
     def __repr__(self):
         return "<Edge ({}, {}): {}>".format(self.v1(), self.v2(), self.weight())
 
+# A field holding just "-", but not the sign of a negative weight.
+NO_EDGE_FIELD = re.compile(r'(?<![^,\s])-(?![^,\s])')
+
+def parse_edge_arrays(graphfile, blocksize=1024):
+    """Parses the weight matrix in graphfile, blocksize rows at a time.
+    Each row in the input file consists of comma-separated values which
+    are either a decimal integer (signifying an edge weight) or the
+    string "-".  The matrix is assumed to be symmetric, so only
+    its upper triangle is read.
+
+    Returns a tuple (nvertices, v1, v2, weight), where v1, v2 and weight
+    are numpy arrays listing each edge once with v1 < v2.
+
+    Raises ValueError if the file contains non-numeric fields or rows of
+    different lengths, or if the matrix is not square.
+    """
+    v1, v2, weight = [], [], []
+    nrows = 0
+    ncols = None
+    with open(graphfile, 'r') as f:
+        while True:
+            lines = [ line for line in itertools.islice(f, blocksize)
+                      if line.strip() ]
+            if not lines:
+                break
+            if ncols is None:
+                ncols = lines[0].count(',') + 1
+            if any(line.count(',') != ncols - 1 for line in lines):
+                raise ValueError("rows of different lengths in " + graphfile)
+            text = NO_EDGE_FIELD.sub('0', ','.join(lines))
+            values = numpy.array(text.replace(',', ' ').split())
+            if len(values) != len(lines) * ncols:
+                raise ValueError("rows of different lengths in " + graphfile)
+            block = values.astype(numpy.int64).reshape(len(lines), ncols)
+            rows = numpy.arange(nrows, nrows + len(lines))[:, numpy.newaxis]
+            i, j = numpy.nonzero((numpy.arange(ncols) > rows) & (block != 0))
+            v1.append(i + nrows)
+            v2.append(j)
+            weight.append(block[i, j])
+            nrows += len(lines)
+    if ncols is not None and ncols != nrows:
+        raise ValueError("matrix is not square in " + graphfile)
+    if not v1:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return 0, empty, empty, empty
+    return (nrows, numpy.concatenate(v1), numpy.concatenate(v2),
+            numpy.concatenate(weight))
+
+# Bumped whenever parsing changes, so that old caches are not reused.
+EDGE_CACHE_VERSION = 3
+
+def edge_cache_file(graphfile, cachedir):
+    """Returns the path of the cache file in cachedir for graphfile.
+    The name includes a hash of the file's absolute path, size and
+    modification time, and of EDGE_CACHE_VERSION, so a changed file never
+    matches an old cache."""
+    st = os.stat(graphfile)
+    ident = '{}:{}:{}:{}'.format(os.path.abspath(graphfile), st.st_size,
+                                 st.st_mtime, EDGE_CACHE_VERSION)
+    return os.path.join(cachedir, '{}.{}.npy'.format(
+        os.path.basename(graphfile), hashlib.sha1(ident).hexdigest()[:16]))
+
+def load_edge_arrays(graphfile, cachedir=None):
+    """Returns the tuple (nvertices, v1, v2, weight) for the network in
+    graphfile, as parsed by parse_edge_arrays().
+
+    If cachedir is given, the parsed edges are saved there in a .npy file
+    named by edge_cache_file(), and later calls for the same unchanged
+    file memory-map the cache instead of parsing.  The cache holds a
+    (E+1) x 3 int64 array: row 0 is (nvertices, 0, 0) and each further
+    row is an edge (v1, v2, weight).
+    """
+    if cachedir is None:
+        return parse_edge_arrays(graphfile)
+    cachefile = edge_cache_file(graphfile, cachedir)
+    if not os.path.exists(cachefile):
+        nvertices, v1, v2, weight = parse_edge_arrays(graphfile)
+        table = numpy.zeros((len(weight) + 1, 3), dtype=numpy.int64)
+        table[0, 0] = nvertices
+        table[1:, 0] = v1
+        table[1:, 1] = v2
+        table[1:, 2] = weight
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        # Write to a temporary name first, so that an interrupted run
+        # never leaves a partial cache file behind.
+        tmpfile = cachefile + '.tmp.npy'
+        numpy.save(tmpfile, table)
+        os.rename(tmpfile, cachefile)
+    table = numpy.load(cachefile, mmap_mode='r')
+    return int(table[0, 0]), table[1:, 0], table[1:, 1], table[1:, 2]
+
+
 class Graph:
-    def __init__(self, graphfile=None):
+    def __init__(self, graphfile=None, cachedir=None):
         self._edges = []
         if graphfile is not None:
-            self.init_from_file(graphfile)
+            self.init_from_file(graphfile, cachedir)
 
-    def init_from_file(self, graphfile):
+    def init_from_file(self, graphfile, cachedir=None):
         """Initialize a graph using CSV data from graphfile.
         Each row in the input file consists of comma-separated values which
         are either a decimal integer (signifying an edge weight) or the
-        string "-".
+        string "-".  The file is read with load_edge_arrays(), using the
+        cache in cachedir if one is given.
 
         The Graph object stores this data as a two-dimensional array of
         cells. The cell at coordinates (i,j) represents the weight of the
         edge between vertices i and j. A weight of 0 means that no edge
         exists between those nodes.
         """
-        with open(graphfile, 'r') as f:
-            csvreader = csv.reader(f)
-            for row in csvreader:
-                edges = [ (0 if cell == '-' else int(cell))
-                          for cell in row ]
-                self._edges.append(edges)
+        nvertices, v1, v2, weight = load_edge_arrays(graphfile, cachedir)
+        matrix = numpy.zeros((nvertices, nvertices), dtype=numpy.int64)
+        matrix[v1, v2] = weight
+        matrix[v2, v1] = weight
+        self._edges = matrix.tolist()
 
     def num_vertices(self):
         return len(self._edges)
@@ -89,57 +221,724 @@ class Graph:
         self._edges[e.v1()][e.v2()] = e.weight()
         self._edges[e.v2()][e.v1()] = e.weight()
 
+    def add_edges(self, v1, v2, weight):
+        """Adds the edges given by the parallel sequences v1, v2 and weight
+        to the graph, replacing any edges already present between the same
+        vertices."""
+        for i, j, w in zip(v1, v2, weight):
+            self.add_edge(Edge(int(i), int(j), int(w)))
+
     def edges(self):
         """Generates all edges in the graph, in no particular order.
         Each edge is represented as a tuple (i,j)."""
-        for i in range(self.num_vertices()):
-            for j in range(self.num_vertices()):
-                e = self.edge(i, j)
-                if e is not None:
-                    yield e
+        for i, row in enumerate(self._edges):
+            for j, w in enumerate(row):
+                if w != 0:
+                    yield Edge(i, j, w)
+
+    def edge_tuples(self):
+        """Generates each undirected edge in the graph once, as a tuple
+        (weight, v1, v2) with v1 < v2."""
+        for i, row in enumerate(self._edges):
+            for j in xrange(i+1, len(row)):
+                if row[j] != 0:
+                    yield (row[j], i, j)
 
     def total_weight(self):
         return sum([ sum(row) for row in self._edges ]) / 2
 
+    def edge_arrays(self):
+        """Returns the edges of the graph as a tuple of three numpy arrays
+        (v1, v2, weight), listing each undirected edge once with v1 < v2."""
+        if not self._edges:
+            empty = numpy.zeros(0, dtype=numpy.int64)
+            return empty, empty, empty
+        matrix = numpy.array(self._edges, dtype=numpy.int64)
+        v1, v2 = numpy.nonzero(numpy.triu(matrix, 1))
+        return v1, v2, matrix[v1, v2]
+
+
+class SparseGraph:
+    """A graph with the same interface as Graph, for large sparse networks.
+
+    Each undirected edge is stored once, with v1 < v2, in parallel numpy
+    arrays sorted by the key v1 * num_vertices + v2, so that looking up
+    an edge is a binary search.  Edges added one at a time with add_edge()
+    collect in a small dict and are merged into the arrays in bulk once
+    there are enough of them.  A weight of 0 means that no edge exists
+    between two vertices, just as in Graph; removed edges are dropped
+    from the arrays at the next merge.
+    """
+
+    def __init__(self, graphfile=None, cachedir=None):
+        self.set_vertices(0)
+        if graphfile is not None:
+            self.init_from_file(graphfile, cachedir)
+
+    @classmethod
+    def from_arrays(cls, nvertices, v1, v2, weight):
+        """Returns a new SparseGraph with nvertices vertices and the edges
+        given by the parallel sequences v1, v2 and weight.  Edges may be
+        given in either direction; if an edge is given more than once,
+        the last weight given for it is used."""
+        g = cls()
+        g.set_vertices(nvertices)
+        g.add_edges(v1, v2, weight)
+        return g
+
+    def init_from_file(self, graphfile, cachedir=None):
+        """Initialize a graph using CSV data from graphfile, in the same
+        format read by Graph.init_from_file().  The file is read a block
+        of rows at a time, so the dense matrix is never built."""
+        nvertices, v1, v2, weight = load_edge_arrays(graphfile, cachedir)
+        self.set_vertices(nvertices)
+        self.add_edges(v1, v2, weight)
+
+    def num_vertices(self):
+        return self._nvertices
+
+    def set_vertices(self, n):
+        """Sets the number of vertices in the graph to n, removing any
+        edges."""
+        self._nvertices = n
+        self._keys = numpy.zeros(0, dtype=numpy.int64)
+        self._weights = numpy.zeros(0, dtype=numpy.int64)
+        self._pending = {}
+        self._dirty = False
+
+    def _key(self, i, j):
+        if not (0 <= i < self._nvertices and 0 <= j < self._nvertices):
+            raise IndexError("vertex out of range")
+        return min(i, j) * self._nvertices + max(i, j)
+
+    def _find(self, key):
+        """Returns the index of key in the sorted key array, or None."""
+        pos = numpy.searchsorted(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return pos
+        return None
+
+    def edge(self, i, j):
+        """Returns an Edge object representing the edge between vertices
+        i and j, or None if no such edge exists."""
+        key = self._key(i, j)
+        weight = self._pending.get(key)
+        if weight is None:
+            pos = self._find(key)
+            weight = 0 if pos is None else int(self._weights[pos])
+        return None if weight == 0 else Edge(i, j, weight)
+
+    def add_edge(self, e):
+        """Adds edge e to the graph, replacing any edge that may have already
+        been present between the specified vertices."""
+        key = self._key(e.v1(), e.v2())
+        pos = self._find(key)
+        self._dirty = True
+        if pos is not None:
+            self._weights[pos] = e.weight()
+            return
+        self._pending[key] = e.weight()
+        if len(self._pending) > max(1024, len(self._keys) / 8):
+            self._merge()
+
+    def add_edges(self, v1, v2, weight):
+        """Adds the edges given by the parallel sequences v1, v2 and weight
+        to the graph in bulk, replacing any edges already present between
+        the same vertices."""
+        v1 = numpy.asarray(v1, dtype=numpy.int64)
+        v2 = numpy.asarray(v2, dtype=numpy.int64)
+        if ((v1 < 0) | (v1 >= self._nvertices) |
+            (v2 < 0) | (v2 >= self._nvertices)).any():
+            raise IndexError("vertex out of range")
+        keys = (numpy.minimum(v1, v2) * self._nvertices +
+                numpy.maximum(v1, v2))
+        self._merge(keys, numpy.asarray(weight, dtype=numpy.int64))
+
+    def _merge(self, keys=None, weights=None):
+        """Merges the pending edges, followed by the edges in the optional
+        arrays keys and weights, into the sorted edge arrays.  Later
+        edges replace earlier ones with the same key, and edges with a
+        weight of 0 are dropped."""
+        allkeys = [self._keys,
+                   numpy.fromiter(self._pending.iterkeys(), numpy.int64),
+                   keys if keys is not None else self._keys[:0]]
+        allweights = [self._weights,
+                      numpy.fromiter(self._pending.itervalues(), numpy.int64),
+                      weights if weights is not None else self._weights[:0]]
+        self._pending = {}
+        self._dirty = False
+        allkeys = numpy.concatenate(allkeys)
+        allweights = numpy.concatenate(allweights)
+        # Find the last occurrence of each key: a stable sort keeps
+        # duplicates in their original order.
+        order = numpy.argsort(allkeys, kind='mergesort')
+        allkeys = allkeys[order]
+        allweights = allweights[order]
+        last = numpy.ones(len(allkeys), dtype=bool)
+        last[:-1] = allkeys[1:] != allkeys[:-1]
+        keep = last & (allweights != 0)
+        self._keys = allkeys[keep]
+        self._weights = allweights[keep]
+
+    def edges(self):
+        """Generates all edges in the graph, in no particular order.
+        Unlike Graph.edges(), each undirected edge is generated once."""
+        for w, i, j in self.edge_tuples():
+            yield Edge(i, j, w)
+
+    def edge_tuples(self):
+        """Generates each undirected edge in the graph once, as a tuple
+        (weight, v1, v2) with v1 < v2."""
+        v1, v2, weight = self.edge_arrays()
+        return iter(zip(weight.tolist(), v1.tolist(), v2.tolist()))
+
+    def num_edges(self):
+        if self._dirty:
+            self._merge()
+        return len(self._keys)
+
+    def total_weight(self):
+        if self._dirty:
+            self._merge()
+        return int(self._weights.sum())
+
+    def edge_arrays(self):
+        """Returns the edges of the graph as a tuple of three numpy arrays
+        (v1, v2, weight), listing each undirected edge once with v1 < v2."""
+        if self._dirty:
+            self._merge()
+        if self._nvertices == 0:
+            return self._keys, self._keys, self._weights
+        v1, v2 = numpy.divmod(self._keys, self._nvertices)
+        return v1, v2, self._weights
+
+
+# A numpy record type for edges, as returned by edge_records().
+EDGE_DTYPE = numpy.dtype([('v1', numpy.int64), ('v2', numpy.int64),
+                          ('weight', numpy.int64)])
+
+def edge_records(graph):
+    """Returns the edges of graph as a numpy array of EDGE_DTYPE records,
+    listing each undirected edge once with v1 < v2.  The array sorts
+    by weight with numpy.sort(records, order='weight')."""
+    v1, v2, weight = graph.edge_arrays()
+    records = numpy.empty(len(weight), dtype=EDGE_DTYPE)
+    records['v1'] = v1
+    records['v2'] = v2
+    records['weight'] = weight
+    return records
+
+
+class DisjointSet:
+    """A union-find structure over the integers 0 to n-1, using path
+    compression and union by rank."""
+
+    def __init__(self, n):
+        self._parent = range(n)
+        self._rank = [0] * n
+        self._count = n
+
+    def count(self):
+        """Returns the number of disjoint sets."""
+        return self._count
+
+    def find(self, x):
+        """Returns the representative of the set containing x."""
+        parent = self._parent
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, x, y):
+        """Merges the sets containing x and y.  Returns False if they were
+        already the same set, True otherwise."""
+        rx = self.find(x)
+        ry = self.find(y)
+        if rx == ry:
+            return False
+        rank = self._rank
+        if rank[rx] < rank[ry]:
+            rx, ry = ry, rx
+        self._parent[ry] = rx
+        if rank[rx] == rank[ry]:
+            rank[rx] += 1
+        self._count -= 1
+        return True
 
-def mintree(graph):
-    """Uses Kruskal's algorithm to build a new Graph representing the
-    minimum spanning tree for the input graph.
 
-    Returns the new Graph object.
+# mintree() uses Prim's algorithm for graphs with at least this fraction
+# of all possible edges, and Kruskal's algorithm otherwise.
+PRIM_DENSITY = 0.5
+
+def kruskal_edges(nvertices, v1, v2, weight):
+    """Finds a minimum spanning tree with Kruskal's algorithm, given
+    the edges of a graph as parallel numpy arrays.  Edges are sorted by
+    weight once with a stable argsort, so ties are broken by position.
+
+    Returns a list of the indices of the tree edges, and the DisjointSet
+    of the vertices they connect.
+    """
+    components = DisjointSet(nvertices)
+    tree = []
+    order = numpy.argsort(weight, kind='mergesort')
+    v1 = v1[order].tolist()
+    v2 = v2[order].tolist()
+    order = order.tolist()
+    for k in xrange(len(order)):
+        if components.union(v1[k], v2[k]):
+            tree.append(order[k])
+            if components.count() == 1:
+                break
+    return tree, components
+
+def prim_edges(nvertices, v1, v2, weight):
+    """Finds a minimum spanning tree with Prim's algorithm and a binary
+    heap, given the edges of a graph as parallel numpy arrays.  The tree
+    is grown from vertex 0.
+
+    Returns a list of the indices of the tree edges.  If the graph is not
+    connected, the tree only spans the component containing vertex 0.
+    """
+    if nvertices == 0:
+        return []
+    # Build adjacency lists in compressed form: the neighbors of vertex v
+    # are neighbor[start[v]:start[v+1]], reached by edge edgeid[...].
+    ends = numpy.concatenate([v1, v2])
+    order = numpy.argsort(ends, kind='mergesort')
+    neighbor = numpy.concatenate([v2, v1])[order].tolist()
+    edgeid = numpy.concatenate([numpy.arange(len(v1))] * 2)[order].tolist()
+    start = numpy.searchsorted(ends[order],
+                               numpy.arange(nvertices + 1)).tolist()
+    weight = weight.tolist()
+
+    intree = [False] * nvertices
+    tree = []
+    heap = [(0, -1, 0)]
+    while heap:
+        w, e, v = heapq.heappop(heap)
+        if intree[v]:
+            continue
+        intree[v] = True
+        if e >= 0:
+            tree.append(e)
+        for k in xrange(start[v], start[v+1]):
+            u = neighbor[k]
+            if not intree[u]:
+                heapq.heappush(heap, (weight[edgeid[k]], edgeid[k], u))
+    return tree
+
+def cheapest_edges(comp, v1, v2, lo=0, hi=None):
+    """Finds the cheapest edge leaving each component among the edges
+    with indices in range(lo, hi).  comp maps each vertex to its
+    component, and the edges v1, v2 must already be sorted from cheapest
+    to most expensive.
+
+    Returns a tuple of numpy arrays (components, edges): edges[k] is the
+    index of the cheapest edge leaving components[k].
+    """
+    c1 = comp[v1[lo:hi]]
+    c2 = comp[v2[lo:hi]]
+    outgoing = numpy.nonzero(c1 != c2)[0]
+    # Every outgoing edge is a candidate for both of its components.
+    edges = outgoing + lo
+    return _first_per_component(
+        numpy.concatenate([c1[outgoing], c2[outgoing]]),
+        numpy.concatenate([edges, edges]), len(v1))
+
+def _first_per_component(comps, edges, nedges):
+    """Returns the lowest-numbered edge for each component, given parallel
+    arrays of candidates and the total number of edges."""
+    # Sorting a single composite key is much faster than a stable
+    # argsort or lexsort of the two arrays.
+    keys = numpy.sort(comps * nedges + edges)
+    comps, edges = numpy.divmod(keys, nedges)
+    first = numpy.ones(len(comps), dtype=bool)
+    first[1:] = comps[1:] != comps[:-1]
+    return comps[first], edges[first]
+
+# Edge and component arrays shared by the worker processes of
+# boruvka_edges().
+_boruvka = {}
+
+def _init_boruvka_worker(shared):
+    for name, array in shared.iteritems():
+        _boruvka[name] = numpy.frombuffer(array, dtype=numpy.int64)
+
+def _boruvka_chunk(args):
+    lo, hi, nedges = args
+    return cheapest_edges(_boruvka['comp'], _boruvka['v1'][:nedges],
+                          _boruvka['v2'][:nedges], lo, hi)
+
+def boruvka_edges(nvertices, v1, v2, weight, workers=None, chunksize=None):
+    """Finds a minimum spanning forest with Boruvka's algorithm, given the
+    edges of a graph as parallel numpy arrays.
+
+    The edges are sorted once by weight with a stable argsort, so ties
+    are broken by edge index just as in kruskal_edges().  Each round then
+    finds the cheapest edge leaving every component with cheapest_edges(),
+    adds those edges to the forest, contracts the components they join,
+    and drops the edges that now lie inside a single component.  With
+    that strict order on the edges, the forest is the same one
+    kruskal_edges() finds.
+
+    If workers is greater than 1, each round's edge scan is split into
+    chunks of chunksize edges and run by a pool of worker processes.
+    The sorted edge arrays and the component labels live in shared
+    memory, and the workers return only the cheapest edge per component.
+
+    Returns a list of the indices of the forest edges.
+    """
+    nedges = len(weight)
+    order = numpy.argsort(weight, kind='mergesort')
+    pool = None
+    if workers > 1 and nedges:
+        shared = {}
+        for name, size in [('v1', nedges), ('v2', nedges),
+                           ('comp', nvertices)]:
+            shared[name] = multiprocessing.RawArray(ctypes.c_int64, size)
+        arrays = dict((name, numpy.frombuffer(array, dtype=numpy.int64))
+                      for name, array in shared.iteritems())
+        arrays['v1'][:] = v1[order]
+        arrays['v2'][:] = v2[order]
+        v1, v2, comp = arrays['v1'], arrays['v2'], arrays['comp']
+        comp[:] = numpy.arange(nvertices)
+        chunksize = chunksize or -(-nedges // workers)
+        pool = multiprocessing.Pool(workers, _init_boruvka_worker, (shared,))
+    else:
+        v1 = v1[order]
+        v2 = v2[order]
+        comp = numpy.arange(nvertices, dtype=numpy.int64)
+
+    tree = []
+    components = DisjointSet(nvertices)
+    try:
+        while nedges:
+            if pool is not None:
+                # The chunk results are merged with the same reduction
+                # that each worker applied to its own chunk.
+                results = pool.map(_boruvka_chunk, [
+                    (lo, min(lo + chunksize, nedges), nedges)
+                    for lo in xrange(0, nedges, chunksize) ])
+                comps, edges = _first_per_component(
+                    numpy.concatenate([ r[0] for r in results ]),
+                    numpy.concatenate([ r[1] for r in results ]), nedges)
+            else:
+                comps, edges = cheapest_edges(comp, v1[:nedges],
+                                              v2[:nedges])
+            if not len(edges):
+                break
+            for k in numpy.unique(edges).tolist():
+                if components.union(int(v1[k]), int(v2[k])):
+                    tree.append(int(order[k]))
+            # Contract: relabel every vertex with its component's root.
+            labels = numpy.unique(comp)
+            relabel = numpy.zeros(nvertices, dtype=numpy.int64)
+            relabel[labels] = [ components.find(c) for c in labels.tolist() ]
+            comp[:] = relabel[comp]
+            # Drop edges inside a component, keeping the rest in order.
+            keep = numpy.nonzero(comp[v1[:nedges]] != comp[v2[:nedges]])[0]
+            nedges = len(keep)
+            v1[:nedges] = v1[keep]
+            v2[:nedges] = v2[keep]
+            order = order[keep]
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return sorted(tree)
+
+def mintree(graph, method=None, workers=None):
+    """Builds a new graph representing the minimum spanning tree for the
+    input graph.
+
+    method may be 'kruskal', 'prim' or 'boruvka'.  If it is None and
+    workers is greater than 1, Boruvka's algorithm is run with that many
+    worker processes.  Otherwise, Prim's algorithm is used for graphs
+    with at least PRIM_DENSITY of all possible edges, and Kruskal's
+    algorithm for sparser graphs.
+
+    Returns the new graph, which is of the same class as the input graph.
 
     Raises RuntimeError if a MST cannot be built from the input graph
-    (i.e. it is not connected).
+    (i.e. it is not connected), and ValueError for an unknown method.
+    Use connected_components() to check a graph first, or
+    spanning_forest() to handle disconnected graphs.
     """
-    edgequeue = []
     nvertices = graph.num_vertices()
-    component = range(nvertices)
-    component_count = nvertices
-    mst = Graph()
-    mst.set_vertices(nvertices)
+    v1, v2, weight = graph.edge_arrays()
+    if method is None and workers > 1:
+        method = 'boruvka'
+    if method is None:
+        possible = nvertices * (nvertices - 1) / 2
+        method = ('prim' if possible and len(weight) >= PRIM_DENSITY * possible
+                  else 'kruskal')
+    if method == 'kruskal':
+        tree, _ = kruskal_edges(nvertices, v1, v2, weight)
+    elif method == 'prim':
+        tree = prim_edges(nvertices, v1, v2, weight)
+    elif method == 'boruvka':
+        tree = boruvka_edges(nvertices, v1, v2, weight, workers)
+    else:
+        raise ValueError("unknown MST method: {}".format(method))
 
-    # Build a heap of edges by weight.
-    for e in graph.edges():
-        heapq.heappush(edgequeue, e)
-    # Add each edge to the new graph if the components are not connected
-    while component_count > 1 and edgequeue:
-        e = heapq.heappop(edgequeue)
-        if component[e.v1()] != component[e.v2()]:
-            mst.add_edge(e)
-            newc = component[e.v1()]
-            oldc = component[e.v2()]
-            for i in range(len(component)):
-                if component[i] == oldc:
-                    component[i] = newc
-            component_count -= 1
-
-    if component_count > 1:
+    if len(tree) < nvertices - 1:
         # The input graph was not connected, so no minimum spanning
         # tree can be built.
         raise RuntimeError("input graph is not connected")
+
+    mst = graph.__class__()
+    mst.set_vertices(nvertices)
+    mst.add_edges(v1[tree], v2[tree], weight[tree])
     return mst
 
 
+def _component_labels(roots):
+    """Converts an array giving a representative vertex for each vertex's
+    component into labels 0, 1, 2... numbered in order of each
+    component's lowest vertex."""
+    _, first, inverse = numpy.unique(roots, return_index=True,
+                                     return_inverse=True)
+    relabel = numpy.empty(len(first), dtype=numpy.int64)
+    relabel[numpy.argsort(first)] = numpy.arange(len(first))
+    return relabel[inverse]
+
+def connected_components(graph):
+    """Finds the connected components of graph without building any
+    spanning tree.
+
+    Every vertex starts as its own component.  Each pass hooks the root
+    of the larger-numbered end of every edge that spans two components
+    onto the lowest root at the other end of any such edge, then applies
+    pointer jumping until
+    every vertex points straight at its root.  Each pass is a few
+    vectorized operations over the edge arrays.
+
+    Returns a tuple (count, labels), where labels is a numpy array
+    giving the component of each vertex, numbered from 0 in order of
+    each component's lowest vertex.
+    """
+    nvertices = graph.num_vertices()
+    v1, v2, _ = graph.edge_arrays()
+    parent = numpy.arange(nvertices, dtype=numpy.int64)
+    while True:
+        p1 = parent[v1]
+        p2 = parent[v2]
+        spanning = p1 != p2
+        if not spanning.any():
+            break
+        p1 = p1[spanning]
+        p2 = p2[spanning]
+        # Hooking only ever points a root at a lower-numbered root, so
+        # no cycles can form.  A root spanned by several edges is hooked
+        # onto the lowest of their other ends, all in the same pass.
+        numpy.minimum.at(parent, numpy.maximum(p1, p2), numpy.minimum(p1, p2))
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+    labels = _component_labels(parent)
+    return (int(labels.max()) + 1 if nvertices else 0), labels
+
+def spanning_forest(graph):
+    """Builds a minimum spanning forest for graph with Kruskal's
+    algorithm, whether or not the graph is connected.
+
+    Returns a tuple (trees, labels).  labels is a numpy array giving the
+    component of each vertex, numbered as in connected_components().
+    trees is a list with one (v1, v2, weight) tuple of numpy arrays per
+    component, in label order, holding the edges of that component's
+    minimum spanning tree.
+    """
+    nvertices = graph.num_vertices()
+    v1, v2, weight = graph.edge_arrays()
+    tree, components = kruskal_edges(nvertices, v1, v2, weight)
+    labels = _component_labels(
+        [ components.find(v) for v in xrange(nvertices) ])
+    tree = numpy.array(sorted(tree), dtype=numpy.int64)
+    tree_labels = labels[v1[tree]]
+    # Group the tree edges by component with a single stable sort, so
+    # that each component's edges are one slice of the sorted array.
+    order = numpy.argsort(tree_labels, kind='mergesort')
+    tree = tree[order]
+    bounds = numpy.searchsorted(tree_labels[order],
+                                numpy.arange(components.count() + 1))
+    trees = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        edges = tree[lo:hi]
+        trees.append((v1[edges], v2[edges], weight[edges]))
+    return trees, labels
+
+
+class DynamicMST:
+    """Maintains a minimum spanning forest of a graph while edges are
+    added, removed and reweighted, without rebuilding it from scratch.
+
+    Inserting an edge (or lowering the weight of an edge outside the
+    tree) uses the cycle property: the new edge joins the tree only if
+    it is lighter than the heaviest edge on the tree path between its
+    endpoints, which it then replaces.  Removing a tree edge (or raising
+    its weight) splits the tree in two, and the lightest graph edge
+    that reconnects the halves is found with a single vectorized scan
+    of the edge arrays.  Each update costs O(V) for the tree search,
+    plus O(E) for the scan when a tree edge is removed.
+
+    If the graph is connected, the forest is its minimum spanning tree.
+    """
+
+    def __init__(self, graph):
+        nvertices = graph.num_vertices()
+        v1, v2, weight = graph.edge_arrays()
+        self._graph = SparseGraph.from_arrays(nvertices, v1, v2, weight)
+        self._graph_weight = self._graph.total_weight()
+        # The tree is kept as adjacency dicts: _tree[v][u] is the weight
+        # of the tree edge between v and u.
+        self._tree = [ {} for _ in xrange(nvertices) ]
+        self._tree_weight = 0
+        self._tree_edges = 0
+        tree, _ = kruskal_edges(nvertices, v1, v2, weight)
+        for k in tree:
+            self._link(int(v1[k]), int(v2[k]), int(weight[k]))
+
+    def num_vertices(self):
+        return self._graph.num_vertices()
+
+    def graph(self):
+        """Returns the current graph, as a SparseGraph."""
+        return self._graph
+
+    def tree(self):
+        """Returns a new SparseGraph holding the current spanning forest."""
+        v1, v2, weight = [], [], []
+        for v, neighbors in enumerate(self._tree):
+            for u, w in neighbors.iteritems():
+                if v < u:
+                    v1.append(v)
+                    v2.append(u)
+                    weight.append(w)
+        return SparseGraph.from_arrays(self.num_vertices(), v1, v2, weight)
+
+    def is_connected(self):
+        """Returns True if the forest is a single spanning tree."""
+        return self._tree_edges == max(self.num_vertices() - 1, 0)
+
+    def total_weight(self):
+        """Returns the total weight of the spanning forest."""
+        return self._tree_weight
+
+    def savings(self):
+        """Returns the weight of the graph edges left out of the forest."""
+        return self._graph_weight - self._tree_weight
+
+    def in_tree(self, i, j):
+        return j in self._tree[i]
+
+    def add_edge(self, e):
+        """Adds edge e to the graph, replacing any edge that may have
+        already been present between the specified vertices, and updates
+        the spanning forest."""
+        self.update_weight(e.v1(), e.v2(), e.weight())
+
+    def remove_edge(self, i, j):
+        """Removes the edge between vertices i and j, if there is one, and
+        updates the spanning forest."""
+        self.update_weight(i, j, 0)
+
+    def update_weight(self, i, j, weight):
+        """Sets the weight of the edge between vertices i and j, adding
+        the edge if it is not present or removing it if weight is 0, and
+        updates the spanning forest."""
+        old = self._graph.edge(i, j)
+        old = 0 if old is None else old.weight()
+        if i == j or weight == old:
+            return
+        self._graph.add_edge(Edge(i, j, weight))
+        self._graph_weight += weight - old
+
+        if self.in_tree(i, j):
+            if weight != 0 and weight < old:
+                self._cut(i, j)
+                self._link(i, j, weight)
+            else:
+                # The edge got heavier or disappeared: cut it, and
+                # reconnect the halves with the lightest edge between them.
+                self._cut(i, j)
+                self._reconnect(i, j)
+        elif weight != 0 and (old == 0 or weight < old):
+            self._insert(i, j, weight)
+
+    def _link(self, i, j, weight):
+        self._tree[i][j] = weight
+        self._tree[j][i] = weight
+        self._tree_weight += weight
+        self._tree_edges += 1
+
+    def _cut(self, i, j):
+        self._tree_weight -= self._tree[i].pop(j)
+        del self._tree[j][i]
+        self._tree_edges -= 1
+
+    def _tree_path(self, i, j):
+        """Returns the list of tree edges (weight, v1, v2) on the path from
+        i to j, or None if they are not connected in the forest."""
+        parent = {i: None}
+        stack = [i]
+        while stack and j not in parent:
+            v = stack.pop()
+            for u in self._tree[v]:
+                if u not in parent:
+                    parent[u] = v
+                    stack.append(u)
+        if j not in parent:
+            return None
+        path = []
+        v = j
+        while parent[v] is not None:
+            path.append((self._tree[v][parent[v]], parent[v], v))
+            v = parent[v]
+        return path
+
+    def _insert(self, i, j, weight):
+        """Offers the non-tree edge (i, j) to the forest."""
+        path = self._tree_path(i, j)
+        if path is None:
+            self._link(i, j, weight)
+            return
+        heaviest, u, v = max(path)
+        if weight < heaviest:
+            self._cut(u, v)
+            self._link(i, j, weight)
+
+    def _component(self, i):
+        """Returns a boolean numpy array marking the vertices of the tree
+        containing vertex i."""
+        seen = numpy.zeros(self.num_vertices(), dtype=bool)
+        seen[i] = True
+        stack = [i]
+        while stack:
+            v = stack.pop()
+            for u in self._tree[v]:
+                if not seen[u]:
+                    seen[u] = True
+                    stack.append(u)
+        return seen
+
+    def _reconnect(self, i, j):
+        """Links the trees containing i and j with the lightest graph edge
+        between them, if there is one."""
+        side_i = self._component(i)
+        side_j = self._component(j)
+        v1, v2, weight = self._graph.edge_arrays()
+        crossing = numpy.nonzero((side_i[v1] & side_j[v2]) |
+                                 (side_j[v1] & side_i[v2]))[0]
+        if len(crossing):
+            k = crossing[numpy.argmin(weight[crossing])]
+            self._link(int(v1[k]), int(v2[k]), int(weight[k]))
+
+
 if __name__ == '__main__':
     t1 = time.clock()
     g = Graph('p107_network.txt')
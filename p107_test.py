@@ -1,8 +1,17 @@
 #! /usr/bin/env python
 
+import heapq
+import os
+import shutil
+import tempfile
 import unittest
 
-from p107 import Edge, Graph, mintree
+import numpy
+
+from p107 import DisjointSet, DynamicMST, Edge, Graph, SparseGraph
+from p107 import boruvka_edges, connected_components, edge_records
+from p107 import kruskal_edges, mintree, spanning_forest
+from p107 import edge_cache_file, load_edge_arrays, parse_edge_arrays
 
 class TestEuler107(unittest.TestCase):
 
@@ -20,6 +29,28 @@ class TestEuler107(unittest.TestCase):
         self.assertGreater(edge1, edge2)
         self.assertEqual(edge2, edge3)
 
+    def test_edge_tuples(self):
+        "Tests the compact edge representations."
+        edge = Edge(1, 2, 1000)
+        self.assertFalse(hasattr(edge, '__dict__'))
+        self.assertEqual((1000, 1, 2), edge.as_tuple())
+
+        for g in [Graph(), SparseGraph()]:
+            g.set_vertices(4)
+            g.add_edge(Edge(0, 1, 5))
+            g.add_edge(Edge(3, 2, 1))
+            g.add_edge(Edge(0, 2, 3))
+            heap = list(g.edge_tuples())
+            heapq.heapify(heap)
+            self.assertEqual([(1, 2, 3), (3, 0, 2), (5, 0, 1)],
+                             [heapq.heappop(heap) for _ in range(3)])
+
+            records = edge_records(g)
+            self.assertEqual([1, 3, 5],
+                             list(numpy.sort(records, order='weight')['weight']))
+            self.assertEqual(set([(0, 1), (0, 2), (2, 3)]),
+                             set(zip(records['v1'], records['v2'])))
+
     def test_graph(self):
         "Tests simple graph building operations."
         g = Graph()
@@ -57,6 +88,330 @@ class TestEuler107(unittest.TestCase):
         self.assertEqual(Edge(0, 0, 2), mg.edge(0, 2))
         self.assertIsNone(mg.edge(1,2))
 
+    def test_mst_methods(self):
+        """Tests that Kruskal's and Prim's algorithms build spanning trees
+        of the same weight for the problem network."""
+        g = Graph('p107_network.txt')
+        for method in [None, 'kruskal', 'prim']:
+            mg = mintree(g, method)
+            self.assertEqual(g.num_vertices() - 1,
+                             len(mg.edge_arrays()[0]))
+            self.assertEqual(259679, g.total_weight() - mg.total_weight())
+        self.assertEqual(259679,
+                         g.total_weight() - mintree(g, workers=2).total_weight())
+        with self.assertRaises(ValueError):
+            mintree(g, 'reverse-delete')
+
+    def test_disconnected(self):
+        """Tests that mintree raises RuntimeError for a disconnected
+        graph."""
+        g = Graph()
+        g.set_vertices(4)
+        g.add_edge(Edge(0, 1, 1))
+        g.add_edge(Edge(2, 3, 1))
+        for method in ['kruskal', 'prim', 'boruvka']:
+            with self.assertRaises(RuntimeError):
+                mintree(g, method)
+
+    def test_boruvka_matches_kruskal(self):
+        """Tests that Boruvka's algorithm picks exactly the same edges as
+        Kruskal's, including when many weights are tied."""
+        rand = numpy.random.RandomState(13)
+        n = 200
+        v1 = rand.randint(0, n, 2000)
+        v2 = rand.randint(0, n, 2000)
+        g = SparseGraph.from_arrays(n, v1, v2, rand.randint(1, 5, 2000))
+        v1, v2, weight = g.edge_arrays()
+        expected, _ = kruskal_edges(n, v1, v2, weight)
+        self.assertEqual(sorted(expected),
+                         boruvka_edges(n, v1, v2, weight))
+        self.assertEqual(sorted(expected),
+                         boruvka_edges(n, v1, v2, weight, workers=3,
+                                       chunksize=100))
+
+    def test_disjoint_set(self):
+        "Tests union-find operations."
+        s = DisjointSet(5)
+        self.assertEqual(5, s.count())
+        self.assertTrue(s.union(0, 1))
+        self.assertTrue(s.union(3, 4))
+        self.assertFalse(s.union(1, 0))
+        self.assertEqual(3, s.count())
+        self.assertEqual(s.find(0), s.find(1))
+        self.assertNotEqual(s.find(0), s.find(3))
+        self.assertTrue(s.union(1, 4))
+        self.assertEqual(s.find(0), s.find(3))
+        self.assertEqual(2, s.count())
+
+
+class TestSparseGraph(unittest.TestCase):
+
+    def test_graph(self):
+        "Tests simple sparse graph building operations."
+        g = SparseGraph()
+        g.set_vertices(3)
+        self.assertEqual(3, g.num_vertices())
+        self.assertIsNone(g.edge(0, 1))
+        self.assertIsNone(g.edge(1, 2))
+        self.assertIsNone(g.edge(0, 2))
+
+        g.add_edge(Edge(0, 1, 1))
+        g.add_edge(Edge(2, 1, 5))
+        g.add_edge(Edge(0, 2, 2))
+        self.assertEqual(Edge(0, 0, 1), g.edge(1, 0))
+        self.assertEqual(Edge(0, 0, 5), g.edge(1, 2))
+        self.assertEqual(Edge(0, 0, 2), g.edge(0, 2))
+        self.assertEqual(3, len(list(g.edges())))
+
+        # Test replacing an existing edge, before and after a merge.
+        g.add_edge(Edge(1, 2, 13))
+        self.assertEqual(Edge(0, 0, 13), g.edge(1, 2))
+        self.assertEqual(16, g.total_weight())
+        g.add_edge(Edge(2, 1, 7))
+        self.assertEqual(Edge(0, 0, 7), g.edge(1, 2))
+        self.assertEqual(10, g.total_weight())
+
+        # A weight of zero removes the edge.
+        g.add_edge(Edge(0, 1, 0))
+        self.assertIsNone(g.edge(0, 1))
+        self.assertEqual(2, g.num_edges())
+
+    def test_from_arrays(self):
+        "Tests bulk construction, including duplicate edges."
+        g = SparseGraph.from_arrays(4, [0, 3, 1, 2], [1, 2, 0, 0], [4, 5, 6, 7])
+        self.assertEqual(Edge(0, 0, 6), g.edge(0, 1))
+        self.assertEqual(Edge(0, 0, 5), g.edge(2, 3))
+        self.assertEqual(Edge(0, 0, 7), g.edge(0, 2))
+        self.assertIsNone(g.edge(1, 3))
+        v1, v2, weight = g.edge_arrays()
+        self.assertEqual([0, 0, 2], list(v1))
+        self.assertEqual([1, 2, 3], list(v2))
+        self.assertEqual([6, 7, 5], list(weight))
+
+    def test_vertex_range(self):
+        "Tests that vertices outside the graph are rejected."
+        g = SparseGraph()
+        g.set_vertices(5)
+        with self.assertRaises(IndexError):
+            g.add_edge(Edge(0, 7, 3))
+        with self.assertRaises(IndexError):
+            g.add_edge(Edge(-1, 2, 3))
+        with self.assertRaises(IndexError):
+            g.add_edges([0, 1], [2, 5], [3, 4])
+        with self.assertRaises(IndexError):
+            g.edge(5, 0)
+        self.assertIsNone(g.edge(1, 2))
+        self.assertEqual(0, g.num_edges())
+
+    def test_many_edges(self):
+        "Tests a sparse graph with more edges than fit in the pending set."
+        n = 5000
+        g = SparseGraph()
+        g.set_vertices(n)
+        for i in range(n - 1):
+            g.add_edge(Edge(i, i + 1, i + 1))
+        self.assertEqual(n - 1, g.num_edges())
+        self.assertEqual(Edge(0, 0, 4000), g.edge(4000, 3999))
+        self.assertEqual(n * (n - 1) / 2, g.total_weight())
+
+    def test_network_file(self):
+        "Tests that dense and sparse graphs agree on the problem network."
+        g = Graph('p107_network.txt')
+        sg = SparseGraph('p107_network.txt')
+        self.assertEqual(g.num_vertices(), sg.num_vertices())
+        self.assertEqual(g.total_weight(), sg.total_weight())
+        for v1, v2, weight in zip(*g.edge_arrays()):
+            self.assertEqual(Edge(0, 0, weight), sg.edge(v1, v2))
+        self.assertEqual(len(g.edge_arrays()[0]), sg.num_edges())
+        self.assertEqual(mintree(g).total_weight(),
+                         mintree(sg).total_weight())
+
+
+class TestSpanningForest(unittest.TestCase):
+
+    def setUp(self):
+        # Three components: {0, 2, 5}, {1, 4} and {3}.
+        self.g = SparseGraph.from_arrays(
+            6, [0, 2, 0, 1], [2, 5, 5, 4], [3, 4, 9, 1])
+
+    def test_connected_components(self):
+        "Tests component labels for a disconnected graph."
+        count, labels = connected_components(self.g)
+        self.assertEqual(3, count)
+        self.assertEqual([0, 1, 0, 2, 1, 0], list(labels))
+
+        count, labels = connected_components(Graph('p107_network.txt'))
+        self.assertEqual(1, count)
+        self.assertEqual(0, labels.max())
+
+        empty = SparseGraph()
+        self.assertEqual(0, connected_components(empty)[0])
+
+    def test_random_components(self):
+        "Tests component labels against union-find on a random graph."
+        rand = numpy.random.RandomState(14)
+        n = 500
+        g = SparseGraph.from_arrays(n, rand.randint(0, n, 300),
+                                    rand.randint(0, n, 300), [1] * 300)
+        v1, v2, _ = g.edge_arrays()
+        components = DisjointSet(n)
+        for i, j in zip(v1, v2):
+            components.union(i, j)
+        count, labels = connected_components(g)
+        self.assertEqual(components.count(), count)
+        for i, j in zip(rand.randint(0, n, 1000), rand.randint(0, n, 1000)):
+            self.assertEqual(components.find(i) == components.find(j),
+                             labels[i] == labels[j])
+
+    def test_star_components(self):
+        "Tests a star centred on its highest vertex, plus a separate path."
+        n = 1 << 14
+        leaves = numpy.arange(n - 1)
+        star = SparseGraph.from_arrays(n + 3, numpy.append(leaves, [n, n + 1]),
+                                       numpy.append([n - 1] * (n - 1),
+                                                    [n + 2, n + 2]),
+                                       [1] * (n + 1))
+        count, labels = connected_components(star)
+        self.assertEqual(2, count)
+        self.assertEqual([0] * n + [1] * 3, list(labels))
+
+    def test_spanning_forest(self):
+        "Tests per-component trees for a disconnected graph."
+        with self.assertRaises(RuntimeError):
+            mintree(self.g)
+        trees, labels = spanning_forest(self.g)
+        self.assertEqual(list(connected_components(self.g)[1]), list(labels))
+        self.assertEqual(3, len(trees))
+        self.assertEqual([(0, 2, 3), (2, 5, 4)], zip(*trees[0]))
+        self.assertEqual([(1, 4, 1)], zip(*trees[1]))
+        self.assertEqual([], zip(*trees[2]))
+
+
+class TestDynamicMST(unittest.TestCase):
+
+    def forest_weight(self, graph):
+        "Returns the weight of a minimum spanning forest built from scratch."
+        v1, v2, weight = graph.edge_arrays()
+        tree, _ = kruskal_edges(graph.num_vertices(), v1, v2, weight)
+        return int(weight[tree].sum())
+
+    def test_network(self):
+        "Tests that the initial tree matches mintree on the problem network."
+        g = Graph('p107_network.txt')
+        dm = DynamicMST(g)
+        self.assertTrue(dm.is_connected())
+        self.assertEqual(259679, dm.savings())
+        self.assertEqual(mintree(g).total_weight(), dm.tree().total_weight())
+
+    def test_updates(self):
+        "Tests the forest against a full rebuild after every update."
+        rand = numpy.random.RandomState(107)
+        n = 30
+        g = SparseGraph()
+        g.set_vertices(n)
+        for _ in range(60):
+            i, j = rand.randint(0, n, 2)
+            if i != j:
+                g.add_edge(Edge(i, j, rand.randint(1, 50)))
+        dm = DynamicMST(g)
+        for _ in range(500):
+            i, j = rand.randint(0, n, 2)
+            weight = rand.choice([0, 0, rand.randint(1, 50)])
+            if rand.randint(2):
+                dm.update_weight(i, j, weight)
+            elif weight:
+                dm.add_edge(Edge(i, j, weight))
+            else:
+                dm.remove_edge(i, j)
+            expected = self.forest_weight(dm.graph())
+            self.assertEqual(expected, dm.total_weight())
+            self.assertEqual(expected, dm.tree().total_weight())
+            self.assertEqual(dm.graph().total_weight() - expected,
+                             dm.savings())
+
+    def test_connectivity(self):
+        "Tests that removing a bridge disconnects the forest."
+        g = Graph()
+        g.set_vertices(3)
+        g.add_edge(Edge(0, 1, 1))
+        g.add_edge(Edge(1, 2, 5))
+        dm = DynamicMST(g)
+        self.assertTrue(dm.is_connected())
+        dm.remove_edge(1, 2)
+        self.assertFalse(dm.is_connected())
+        self.assertEqual(1, dm.total_weight())
+        dm.add_edge(Edge(0, 2, 2))
+        self.assertTrue(dm.is_connected())
+        self.assertTrue(dm.in_tree(2, 0))
+        self.assertEqual(3, dm.total_weight())
+
+
+class TestNetworkFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+        self.graphfile = os.path.join(self.tmpdir, 'network.txt')
+        with open(self.graphfile, 'w') as f:
+            f.write("-,16,12,-\n"
+                    "16,-,-,17\n"
+                    "12,-,-,28\n"
+                    "-,17,28,-\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse(self):
+        "Tests that parsing agrees for every block size."
+        for blocksize in [1, 3, 1024]:
+            nvertices, v1, v2, weight = parse_edge_arrays(self.graphfile,
+                                                          blocksize)
+            self.assertEqual(4, nvertices)
+            self.assertEqual([(0, 1, 16), (0, 2, 12), (1, 3, 17), (2, 3, 28)],
+                             zip(v1, v2, weight))
+
+    def test_parse_negative(self):
+        "Tests that negative weights keep their sign."
+        with open(self.graphfile, 'w') as f:
+            f.write("-,-5,3\n-5,-,-\n3,-, -\n")
+        nvertices, v1, v2, weight = parse_edge_arrays(self.graphfile)
+        self.assertEqual([(0, 1, -5), (0, 2, 3)], zip(v1, v2, weight))
+
+    def test_parse_invalid(self):
+        "Tests that malformed network files are rejected."
+        for text in ["-,1\n1,x\n", "-,1,2\n1,-\n", "1,-,2\n3,2\n4,5,6,7\n",
+                     "-,1\n1,--\n", "-,1\n1,5-3\n", "-,1,2\n1,-,3\n",
+                     "-,1\n1,-\n2,3\n"]:
+            with open(self.graphfile, 'w') as f:
+                f.write(text)
+            with self.assertRaises(ValueError):
+                parse_edge_arrays(self.graphfile)
+
+    def test_cache(self):
+        "Tests that the edge cache is written, reused and invalidated."
+        g = Graph(self.graphfile, self.cachedir)
+        cachefile = edge_cache_file(self.graphfile, self.cachedir)
+        self.assertTrue(os.path.exists(cachefile))
+        self.assertEqual(Edge(0, 0, 17), g.edge(3, 1))
+        self.assertEqual(73, g.total_weight())
+
+        # Loading again maps the cache file instead of parsing.
+        nvertices, v1, _, _ = load_edge_arrays(self.graphfile, self.cachedir)
+        self.assertEqual(4, nvertices)
+        self.assertIsInstance(v1, numpy.memmap)
+
+        # Changing the file selects a new cache file.
+        with open(self.graphfile, 'w') as f:
+            f.write("-,1\n1,-\n")
+        os.utime(self.graphfile, (0, os.path.getmtime(cachefile) - 1000))
+        self.assertNotEqual(cachefile,
+                            edge_cache_file(self.graphfile, self.cachedir))
+        nvertices, _, _, weight = load_edge_arrays(self.graphfile,
+                                                   self.cachedir)
+        self.assertEqual((2, [1]), (nvertices, list(weight)))
+        sg = SparseGraph(self.graphfile, self.cachedir)
+        self.assertEqual(1, sg.total_weight())
+
 
 if __name__ == '__main__':
     unittest.main()